@@ -14,7 +14,8 @@ import re
 from   bs4                import BeautifulSoup
 from   rsclib.autosuper   import autosuper
 from   ff_spider.common   import Interface, Inet4, Inet6, unroutable
-from   ff_spider.common   import WLAN_Config, Soup_Client
+from   ff_spider.common   import WLAN_Config, Soup_Client, fetch_pages
+from   ff_spider.common   import Visitor
 from   ff_spider.luci     import Version_Mixin
 from   ff_olsr.common     import Topo_Entry, HNA_Entry
 
@@ -32,49 +33,60 @@ class Interfaces (Soup_Client, Version_Mixin) :
         , nein = False
         )
 
+    cache_attrs = \
+        ('if_by_name', 'ips', 'version', 'luci_version', 'bf_version')
+
     def parse (self) :
         self.if_by_name = {}
         self.ips        = {}
-        for div in self.soup.find_all ("div") :
-            self.try_get_version (div)
-            if div.get ('id') == 'maincontent' and not self.if_by_name :
-                tbl = div.find ("table")
-                if tbl :
-                    for n, tr in enumerate (tbl.find_all (recursive = False)) :
-                        child = tr.find ()
-                        if child.name == 'th' :
-                            l = ('Interface', 'Schnittstelle')
-                            assert child.string in l, child.string
-                            continue
-                        name, status, mtu, wlan, ip, mask, bcast = \
-                            (x.string for x in tr.find_all (recursive = False))
-                        if name in self.if_by_name :
-                            iface = self.if_by_name [name]
-                        else :
-                            iface = Interface (n, name, mtu)
-                            iface.is_wlan = self.yesno.get (wlan, False)
-                        if status == 'DOWN' :
-                            continue
-                        # append IP address to interface if there is one
-                        if ip is not None :
-                            if ':' in ip :
-                                i6 = Inet6 (ip, mask, bcast, iface = name)
-                                iface.append_inet6 (i6)
-                            else :
-                                i4 = Inet4 (ip, mask, bcast, iface = name)
-                                iface.append_inet4 (i4)
-                                if not unroutable (i4.ip) :
-                                    self.if_by_name [name] = iface
-                                    self.ips [i4] = True
-        self.set_version (self.soup)
-        if not self.if_by_name :
+        visitor = Visitor ()
+        self.register_version (visitor)
+        visitor.register ('div', self.parse_interfaces)
+        visitor.visit (self.soup)
+        self.set_version ()
+    # end def parse
+
+    def parse_interfaces (self, div) :
+        if div.get ('id') != 'maincontent' or self.if_by_name :
             return
-        bfw = Backfire_WLAN_Config (site = self.site)
-        for d in bfw.wlans :
+        tbl = div.find ("table")
+        if not tbl :
+            return
+        for n, tr in enumerate (tbl.find_all (recursive = False)) :
+            child = tr.find ()
+            if child.name == 'th' :
+                l = ('Interface', 'Schnittstelle')
+                assert child.string in l, child.string
+                continue
+            name, status, mtu, wlan, ip, mask, bcast = \
+                (x.string for x in tr.find_all (recursive = False))
+            if name in self.if_by_name :
+                iface = self.if_by_name [name]
+            else :
+                iface = Interface (n, name, mtu)
+                iface.is_wlan = self.yesno.get (wlan, False)
+            if status == 'DOWN' :
+                continue
+            # append IP address to interface if there is one
+            if ip is not None :
+                if ':' in ip :
+                    i6 = Inet6 (ip, mask, bcast, iface = name)
+                    iface.append_inet6 (i6)
+                else :
+                    i4 = Inet4 (ip, mask, bcast, iface = name)
+                    iface.append_inet4 (i4)
+                    if not unroutable (i4.ip) :
+                        self.if_by_name [name] = iface
+                        self.ips [i4] = True
+    # end def parse_interfaces
+
+    def set_wlan_info (self, wlans) :
+        """ Set wlan info from the `Backfire_WLAN_Config` page """
+        for d in wlans :
             if d.name in self.if_by_name :
                 iface = self.if_by_name [d.name]
                 iface.wlan_info = d
-    # end def parse
+    # end def set_wlan_info
 
 # end class Interfaces
 
@@ -87,6 +99,8 @@ class Backfire_WLAN_Config (Soup_Client) :
     title_re     = re.compile \
         (r'.*ignal.*(?:(-[0-9]+)|(?:N/A))\s+d.*oise.*(-[0-9]+)\s+d')
 
+    cache_attrs  = ('wlans',)
+
     def parse (self) :
         wlo = \
             ( 'Wireless Overview'
@@ -135,9 +149,9 @@ class MID_Parser (Soup_Client) :
 
     url = 'cgi-bin/luci/freifunk/olsr/mid/'
 
-    def __init__ (self, site, content) :
+    def __init__ (self, site, content, session = None) :
         self.content = content
-        self.__super.__init__ (site = site)
+        self.__super.__init__ (site = site, session = session)
     # end def __init__
 
     def parse (self) :
@@ -163,9 +177,9 @@ class HNA_Parser (Soup_Client) :
 
     url = 'cgi-bin/luci/freifunk/olsr/hna/'
 
-    def __init__ (self, site, content) :
+    def __init__ (self, site, content, session = None) :
         self.content = content
-        self.__super.__init__ (site = site)
+        self.__super.__init__ (site = site, session = session)
     # end def __init__
 
     def parse (self) :
@@ -192,9 +206,9 @@ class Topo_Parser (Soup_Client) :
 
     url = 'cgi-bin/luci/freifunk/olsr/topology/'
 
-    def __init__ (self, site, content) :
+    def __init__ (self, site, content, session = None) :
         self.content = content
-        self.__super.__init__ (site = site)
+        self.__super.__init__ (site = site, session = session)
     # end def __init__
 
     def parse (self) :
@@ -227,17 +241,29 @@ class Backfire (autosuper) :
 
     parsers = dict (hna = HNA_Parser, mid = MID_Parser, topo = Topo_Parser)
 
-    def __init__ (self, site, request) :
+    def __init__ (self, site, request, session = None) :
         self.site    = site
         self.request = request
-        if 'interfaces' in self.request or 'ips' in self.request :
-            bfi = Interfaces (site = self.site)
+        pages        = {}
+        ifaces       = 'interfaces' in self.request or 'ips' in self.request
+        if ifaces :
+            pages ['bfi']  = Interfaces
+            pages ['wlan'] = Backfire_WLAN_Config
+        for k, v in pyk.iteritems (self.parsers) :
+            if k in self.request :
+                pages [k] = (v, dict (content = self.request [k]))
+        # The wlan config is only needed if there are interfaces
+        p = fetch_pages \
+            (pages, optional = ('wlan',), site = self.site, session = session)
+        if ifaces :
+            bfi = p ['bfi']
+            if bfi.if_by_name :
+                if isinstance (p ['wlan'], Exception) :
+                    raise p ['wlan']
+                bfi.set_wlan_info (p ['wlan'].wlans)
             self.request ['ips']        = bfi.ips
             self.request ['interfaces'] = bfi.if_by_name
             self.request ['version']    = bfi.version
-        for k, v in pyk.iteritems (self.parsers) :
-            if k in self.request :
-                v (site = self.site, content = self.request [k])
     # end def __init__
 
 # end class Backfire
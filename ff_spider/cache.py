@@ -0,0 +1,239 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# #*** <License> ************************************************************#
+# This module is part of the repository CNDB.
+#
+# This module is licensed under the terms of the BSD 3-Clause License
+# <http://www.c-tanzer.at/license/bsd_3c.html>.
+# #*** </License> ***********************************************************#
+
+import math
+import os
+import pickle
+import time
+from   rsclib.autosuper   import autosuper
+from   ff_spider.journal  import open_dump
+
+def load_state (filename, default) :
+    """ Load state pickled by `save_state`, return default if there is
+        no such file (e.g., on the first run).
+    """
+    if not filename or not os.path.exists (filename) :
+        return default
+    f = open_dump (filename)
+    try :
+        return pickle.load (f)
+    finally :
+        f.close ()
+# end def load_state
+
+def save_state (filename, obj) :
+    """ Pickle obj to filename, the old state is replaced atomically so
+        that an interrupted run never leaves a broken state file.
+    """
+    tmp = filename + '.new'
+    if filename.endswith ('.gz') :
+        tmp = filename [:-3] + '.new.gz'
+    f = open_dump (tmp, 'wb')
+    pickle.dump (obj, f, 2)
+    f.close ()
+    os.rename (tmp, filename)
+# end def save_state
+
+class Fingerprint_Cache (autosuper) :
+    """ Cache the detected backend and its parameters (site, url) by
+        IP:port so that the probing of the web frontend can be skipped
+        on the next run. Entries older than `ttl` seconds are ignored.
+    """
+
+    def __init__ (self, filename, ttl = 7 * 86400) :
+        self.filename = filename
+        self.ttl      = ttl
+        self.entries  = load_state (filename, {})
+    # end def __init__
+
+    def get (self, key) :
+        """ Return tuple of backend and params or None """
+        try :
+            t, backend, params = self.entries [key]
+        except KeyError :
+            return None
+        if t + self.ttl < time.time () :
+            return None
+        return backend, params
+    # end def get
+
+    def update (self, key, guess) :
+        params = dict (guess.params)
+        params.pop ('request', None)
+        self.entries [key] = (time.time (), guess.backend, params)
+    # end def update
+
+    def save (self) :
+        save_state (self.filename, self.entries)
+    # end def save
+
+# end class Fingerprint_Cache
+
+class Page_Cache (autosuper) :
+    """ Cache of the pages of each node by IP. For each url of the node
+        we store ETag, Last-Modified, a digest of the content and the
+        pickled state computed by the `parse` method of the page. The
+        state is reused if the page is unchanged.
+    """
+
+    def __init__ (self, filename) :
+        self.filename = filename
+        self.entries  = load_state (filename, {})
+    # end def __init__
+
+    def get (self, ip) :
+        return dict (self.entries.get (ip, {}))
+    # end def get
+
+    def update (self, ip, pages) :
+        self.entries [ip] = pages
+    # end def update
+
+    def save (self) :
+        save_state (self.filename, self.entries)
+    # end def save
+
+# end class Page_Cache
+
+class Latency_History (autosuper) :
+    """ Duration and time to first byte of the last `keep` successful
+        runs of each node by IP. The timeout of a node is the
+        `percentile` of its durations times `factor` plus `margin`
+        seconds, at least `minimum` and at most the global timeout.
+        Nodes without history get the global timeout. After a timeout
+        the timeout of the node is doubled for the next run until it
+        succeeds again, so a node that became slower is not reported as
+        timeout forever. Timeouts are rounded up to whole seconds, the
+        alarm of the worker only takes an int.
+    """
+
+    def __init__ \
+        ( self, filename
+        , keep       = 10
+        , percentile = 0.9
+        , factor     = 2
+        , margin     = 10
+        , minimum    = 20
+        ) :
+        self.filename   = filename
+        self.keep       = keep
+        self.percentile = percentile
+        self.factor     = factor
+        self.margin     = margin
+        self.minimum    = minimum
+        self.entries    = load_state (filename, {})
+    # end def __init__
+
+    def timeout (self, ip, ceiling) :
+        try :
+            samples, timeouts = self.entries [ip]
+        except KeyError :
+            return ceiling
+        if not samples :
+            return ceiling
+        durations = sorted (d for d, ttfb in samples)
+        n = len (durations)
+        t = durations [min (int (n * self.percentile), n - 1)]
+        t = max (t * self.factor + self.margin, self.minimum)
+        t = t * 2 ** min (timeouts, 16)
+        return int (math.ceil (min (t, ceiling)))
+    # end def timeout
+
+    def update (self, ip, duration, ttfb) :
+        samples, timeouts = self.entries.get (ip, ([], 0))
+        samples = (samples + [(duration, ttfb)]) [-self.keep:]
+        self.entries [ip] = (samples, 0)
+    # end def update
+
+    def timed_out (self, ip) :
+        samples, timeouts = self.entries.get (ip, ([], 0))
+        self.entries [ip] = (samples, timeouts + 1)
+    # end def timed_out
+
+    def save (self) :
+        save_state (self.filename, self.entries)
+    # end def save
+
+# end class Latency_History
+
+class Topology_Cache (autosuper) :
+    """ Neighbours of each node by IP at the time it was last spidered
+        successfully, for incremental runs: A node is unchanged if it
+        still has the same neighbours and was spidered less than
+        `max_age` seconds ago, its previous result can be reused.
+    """
+
+    def __init__ (self, filename, max_age = 86400) :
+        self.filename = filename
+        self.max_age  = max_age
+        self.entries  = load_state (filename, {})
+    # end def __init__
+
+    def unchanged (self, ip, neighbours) :
+        try :
+            t, old = self.entries [ip]
+        except KeyError :
+            return False
+        if t + self.max_age < time.time () :
+            return False
+        return old == frozenset (neighbours)
+    # end def unchanged
+
+    def update (self, ip, neighbours) :
+        self.entries [ip] = (time.time (), frozenset (neighbours))
+    # end def update
+
+    def save (self) :
+        save_state (self.filename, self.entries)
+    # end def save
+
+# end class Topology_Cache
+
+class Negative_Cache (autosuper) :
+    """ Consecutive failures of each node by IP and exception name
+        (e.g., `Timeout_Error`, `ValueError`, `Exception`, `ERROR`).
+        After n failures with the same exception the node is probed
+        again after `interval` * 2 ** (n - 1) seconds, at most after
+        `max_interval` seconds, until then the last result is reused.
+    """
+
+    def __init__ (self, filename, interval = 3600, max_interval = 7 * 86400) :
+        self.filename     = filename
+        self.interval     = interval
+        self.max_interval = max_interval
+        self.entries      = load_state (filename, {})
+    # end def __init__
+
+    def get (self, ip) :
+        """ Return last result of ip if its next probe isn't due yet """
+        try :
+            name, n, due, result = self.entries [ip]
+        except KeyError :
+            return None
+        if due <= time.time () :
+            return None
+        return result
+    # end def get
+
+    def update (self, ip, result) :
+        if not isinstance (result, tuple) :
+            self.entries.pop (ip, None)
+            return
+        n = 1
+        if ip in self.entries and self.entries [ip][0] == result [0] :
+            n = self.entries [ip][1] + 1
+        t = min (self.interval * 2 ** min (n - 1, 32), self.max_interval)
+        self.entries [ip] = (result [0], n, time.time () + t, result)
+    # end def update
+
+    def save (self) :
+        save_state (self.filename, self.entries)
+    # end def save
+
+# end class Negative_Cache
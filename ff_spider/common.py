@@ -7,12 +7,18 @@
 # <http://www.c-tanzer.at/license/bsd_3c.html>.
 # #*** </License> ***********************************************************#
 
+import hashlib
+import pickle
+import random
 import requests
+import threading
+import time
 from   _TFL.pyk           import pyk
 
 from   bs4                import BeautifulSoup
 from   rsclib.autosuper   import autosuper
 from   rsclib.IP_Address  import IP4_Address
+from   rsclib.timeout     import Timeout_Error
 
 class Parse_Error (ValueError) :
     pass
@@ -327,23 +333,350 @@ class WLAN_Config (Compare_Mixin) :
 
 # end class WLAN_Config
 
-class Soup_Client (autosuper) :
+class Session (autosuper) :
+    """ HTTP session shared by all `Soup_Client` pages of one node.
+        Connections to the same host:port are kept alive and reused.
+        A different transport with the `get` and `close` methods of
+        `requests.Session` can be passed in, e.g., for testing.
+        If `pages` is given, it is a dictionary of cached pages by url,
+        see `Soup_Client`. An optional `throttle` limits requests and
+        bandwidth over all nodes, the start of two requests to the node
+        is at least `min_gap` seconds apart. The time to first byte
+        of each response is recorded in `ttfb`. If a `deadline` (in
+        seconds since the epoch) is set, the timeouts of the requests
+        are shortened so that no request runs past it and requests
+        after it fail with `Timeout_Error`: This enforces the timeout
+        of a node without signals, e.g., when running in a thread.
+        The `parser` is the default HTML parser for the pages of the
+        node, see `Soup_Client`. Streamed responses are read in chunks
+        of `chunk_size` bytes.
+    """
+    chunk_size = 8192
+
+    def __init__ \
+        ( self
+        , transport = None
+        , pages     = None
+        , throttle  = None
+        , min_gap   = 0
+        , deadline  = None
+        , parser    = 'html.parser'
+        ) :
+        if transport is None :
+            transport = requests.Session ()
+        self.transport = transport
+        self.pages     = pages
+        self.throttle  = throttle
+        self.min_gap   = min_gap
+        self.deadline  = deadline
+        self.parser    = parser
+        self.last      = 0
+        self.lock      = threading.Lock ()
+        self.ttfb      = []
+    # end def __init__
+
+    def wait (self) :
+        """ Wait for the per-node gap and the global throttle """
+        if self.min_gap :
+            with self.lock :
+                now  = time.time ()
+                wait = self.last + self.min_gap - now
+                self.last = max (now, self.last + self.min_gap)
+            if wait > 0 :
+                time.sleep (wait)
+        if self.throttle :
+            self.throttle.before_request ()
+    # end def wait
+
+    def remaining (self, timeout) :
+        """ Limit timeout to the time left until the deadline """
+        if self.deadline is None :
+            return timeout
+        left = self.deadline - time.time ()
+        if left <= 0 :
+            raise Timeout_Error ("Deadline of node exceeded")
+        if timeout is None :
+            return left
+        return min (timeout, left)
+    # end def remaining
+
+    def cached (self, url) :
+        """ Return cached entry for url: A tuple of ETag, Last-Modified,
+            digest of content and pickled state of the parsed page.
+        """
+        if self.pages is None :
+            return None
+        return self.pages.get (url)
+    # end def cached
+
+    def store (self, url, response, digest, state) :
+        if self.pages is None :
+            return
+        self.pages [url] = \
+            ( response.headers.get ('ETag')
+            , response.headers.get ('Last-Modified')
+            , digest
+            , pickle.dumps (state, 2)
+            )
+    # end def store
+
+    def get \
+        ( self, url
+        , timeout = None
+        , retries = 0
+        , delay   = 0
+        , backoff  = 0
+        , headers  = None
+        , complete = None
+        ) :
+        """ Get the given url. The `timeout` is used as connect and
+            read timeout of each request. Requests failing with a
+            connection error or timeout are retried up to `retries`
+            times with jittered exponential backoff starting at
+            `backoff` seconds. A `delay` is waited before the first
+            request. When the last retry times out, a `Timeout_Error`
+            is raised, like when the spider timeout triggers.
+            If `complete` is given, the response is streamed, see
+            `read`.
+        """
+        if delay :
+            time.sleep (self.remaining (delay))
+        kw = {}
+        if complete :
+            kw ['stream'] = True
+        for n in range (retries + 1) :
+            self.wait ()
+            t = self.remaining (timeout)
+            try :
+                r = self.transport.get \
+                    ( url
+                    , verify  = False
+                    , timeout = (t, t)
+                    , headers = headers
+                    , ** kw
+                    )
+                if complete :
+                    size = self.read (r, complete, timeout)
+                else :
+                    size = len (r.content)
+                if self.throttle :
+                    self.throttle.after_request (size)
+                elapsed = getattr (r, 'elapsed', None)
+                if elapsed is not None :
+                    self.ttfb.append (elapsed.total_seconds ())
+                return r
+            except requests.exceptions.Timeout as err :
+                if n >= retries :
+                    raise Timeout_Error ("%s: %s" % (url, err))
+            except requests.exceptions.ConnectionError :
+                if n >= retries :
+                    raise
+            wait = random.uniform (0, backoff * 2 ** n)
+            time.sleep (self.remaining (wait))
+    # end def get
+
+    def read (self, r, complete, timeout) :
+        """ Read the streamed response r chunk by chunk, `complete` is
+            called with the content read so far: When it returns an
+            offset, everything needed is there, the connection is
+            closed and the content is cut at the offset. Returns the
+            number of bytes read. Responses that can't be streamed
+            (e.g., of a test transport) are read in full.
+        """
+        if not hasattr (r, 'iter_content') :
+            return len (r.content)
+        data = bytearray ()
+        end  = None
+        try :
+            for chunk in r.iter_content (self.chunk_size) :
+                data += chunk
+                end   = complete (data)
+                if end is not None :
+                    break
+                self.remaining (timeout)
+        finally :
+            r.close ()
+        # requests keeps the content of a consumed response here
+        r._content = bytes (data [:end] if end is not None else data)
+        return len (data)
+    # end def read
+
+    def close (self) :
+        self.transport.close ()
+    # end def close
+
+# end class Session
+
+class Visitor (autosuper) :
+    """ Walk a soup once, calling the handlers registered for the
+        name of each tag (in document order), so that several
+        extractors interested in the same page don't each search the
+        whole tree.
+    """
+
+    def __init__ (self) :
+        self.handlers = {}
+    # end def __init__
+
+    def register (self, name, handler) :
+        """ Call handler with each tag of the given name """
+        self.handlers.setdefault (name, []).append (handler)
+    # end def register
+
+    def visit (self, root) :
+        for tag in root.find_all (list (self.handlers)) :
+            for handler in self.handlers [tag.name] :
+                handler (tag)
+    # end def visit
 
-    def __init__ (self, site, url = None) :
+# end class Visitor
+
+class Soup_Client (autosuper) :
+    """ Fetch and parse a page, the class attributes are used for the
+        timeout in seconds of each request, the number of retries,
+        an initial delay and the start value of the retry backoff.
+        Pages listing the attributes computed by `parse` in
+        `cache_attrs` are cached if the session has a page cache: When
+        the node answers 304 (Not Modified) or the content is unchanged,
+        the attributes are restored from the cache and the page isn't
+        parsed again.
+        The HTML `parser` of BeautifulSoup is 'html.parser' or 'lxml',
+        if `parser` is None, the parser of the session is used. If
+        parsing fails, the page is parsed again with 'html.parser'.
+        Pages needing only some elements of the document set
+        `parse_only` to a `SoupStrainer` for them, only these are built
+        into the soup. Pages that find everything they need near the
+        top of a large document list regular expressions (of bytes) in
+        `complete_re`: The download stops as soon as all of them
+        matched, only the content up to the end of the last match is
+        parsed, see `complete`.
+    """
+    retries     = 2
+    timeout     = 10
+    delay       = 0
+    backoff     = 0.5
+    cache_attrs = ()
+    parser      = None
+    parse_only  = None
+    complete_re = ()
+
+    def __init__ (self, site, url = None, session = None) :
         self.__super.__init__ (site, url)
-        self.site = site
+        self.site    = site
+        self.session = session or Session ()
         url = url or self.url
         if url is not None :
             self.url  = '/'.join ((site, url or self.url))
         else :
             self.url = site
-        r = requests.get (self.url, verify = False)
+        entry   = None
+        headers = {}
+        if self.cache_attrs :
+            entry = self.session.cached (self.url)
+        if entry :
+            etag, modified, digest, state = entry
+            if etag :
+                headers ['If-None-Match'] = etag
+            if modified :
+                headers ['If-Modified-Since'] = modified
+        r = self.session.get \
+            ( self.url
+            , timeout  = self.timeout
+            , retries  = self.retries
+            , delay    = self.delay
+            , backoff  = self.backoff
+            , headers  = headers
+            , complete = self.complete if self.complete_re else None
+            )
         if not r.ok :
             raise ValueError \
                 ("Invalid Status: %s/%s" % (r.status_code, r.reason))
-        self.soup = BeautifulSoup (r.content, 'html.parser')
-        #self.soup = BeautifulSoup (r.content, 'lxml')
-        self.parse ()
+        if entry and r.status_code == 304 :
+            self.__dict__.update (pickle.loads (state))
+            return
+        digest = hashlib.sha1 (r.content).hexdigest ()
+        if entry and entry [2] == digest :
+            self.__dict__.update (pickle.loads (state))
+            return
+        self.parse_content (r.content)
+        if self.cache_attrs :
+            state = dict \
+                ( (k, getattr (self, k))
+                  for k in self.cache_attrs if hasattr (self, k)
+                )
+            self.session.store (self.url, r, digest, state)
     # end def __init__
 
+    def complete (self, data) :
+        """ Offset of the end of the needed content if all of
+            `complete_re` match the data read so far, else None
+        """
+        end = 0
+        for pattern in self.complete_re :
+            m = pattern.search (data)
+            if not m :
+                return None
+            end = max (end, m.end ())
+        return end
+    # end def complete
+
+    def parse_content (self, content) :
+        parser = self.parser or self.session.parser
+        if parser != 'html.parser' :
+            try :
+                self._parse (content, parser)
+                return
+            except Timeout_Error :
+                raise
+            except Exception :
+                pass
+        self._parse (content, 'html.parser')
+    # end def parse_content
+
+    def _parse (self, content, parser) :
+        self.soup = BeautifulSoup \
+            (content, parser, parse_only = self.parse_only)
+        self.parse ()
+    # end def _parse
+
 # end class Soup_Client
+
+def fetch_pages (pages, optional = (), ** kw) :
+    """ Fetch and parse independent pages of a node in parallel, so
+        that the latency is that of the slowest page instead of the
+        sum of all of them. `pages` maps a name to a `Soup_Client`
+        class or to a tuple of class and extra keyword arguments, `kw`
+        (e.g., site and session) are passed to all pages. Returns a
+        dict of the parsed pages by name. The first exception of a page
+        is re-raised, for pages listed in `optional` the exception is
+        returned instead of the page. The threads are not stopped when
+        the caller is interrupted (e.g., by the alarm of the worker),
+        they don't start requests after the deadline of the session.
+    """
+    result = {}
+    errors = []
+    def fetch (name, cls, args) :
+        try :
+            result [name] = cls (** dict (kw, ** args))
+        except Exception as err :
+            if name in optional :
+                result [name] = err
+            else :
+                errors.append (err)
+    threads = []
+    for name, cls in pyk.iteritems (pages) :
+        args = {}
+        if isinstance (cls, tuple) :
+            cls, args = cls
+        t = threading.Thread (target = fetch, args = (name, cls, args))
+        t.daemon = True
+        t.start ()
+        threads.append (t)
+    for t in threads :
+        # join with timeout: python2 won't deliver SIGALRM otherwise
+        while t.is_alive () :
+            t.join (1)
+    if errors :
+        raise errors [0]
+    return result
+# end def fetch_pages
@@ -12,6 +12,7 @@ from   __future__         import print_function
 from   _TFL.pyk           import pyk
 
 import re
+from   bs4                import SoupStrainer
 from   rsclib.autosuper   import autosuper
 from   rsclib.stateparser import Parser
 from   ff_spider.common   import unroutable, Net_Link, Soup_Client
@@ -20,6 +21,7 @@ from   ff_spider.common   import Inet4, Inet6, Interface, WLAN_Config
 pt_mac    = r'((?:[0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2})'
 
 class Interface_Config (Parser) :
+    encoding  = None # lines are already decoded by BeautifulSoup
     re_assign = re.compile (r'^([a-zA-Z0-9_]+)\s*=\s*([a-zA-Z0-9 ]*)$')
     re_brhead = re.compile (r'^bridge name.*$')
     re_bridge = re.compile (r'^(\S+)\s*(\S+)\s*(\S+)\s*(\S+)$')
@@ -102,6 +104,7 @@ class Interface_Config (Parser) :
 # end class Interface_Config
 
 class WLAN_Config_Freifunk (WLAN_Config, Parser) :
+    encoding  = None # lines are already decoded by BeautifulSoup
     r_ifname  = r'^(?:([a-zA-Z0-9]+).*)?'
     r_nick    = r'(?:\s*Nickname:\s*"[^"]*")?'
     re_ssid   = re.compile (r'%sE?SSID:\s*"([^"]+)"%s' % (r_ifname, r_nick))
@@ -182,6 +185,19 @@ class Status (Soup_Client) :
     timeout   = 10
     version   = 'Unknown'
 
+    cache_attrs = ('if_by_name', 'ips', 'wlan_info', 'version')
+    parse_only  = SoupStrainer (['pre', 'td', 'small'])
+    # Interface config, first SSID cell and version: If the version is
+    # not in a small tag we need the whole page for the fallback.
+    complete_re = \
+        ( re.compile
+            ( br'<pre\b[^>]*\bid\s*=\s*["\']?ifconfig\b.*?</pre\s*>'
+            , re.I | re.S
+            )
+        , re.compile (br'<td\b[^>]*>[^<]*SSID:[^<]*</td\s*>', re.I)
+        , re.compile (br'<small\b[^>]*>\s*v?1\.[^<]*</small\s*>', re.I)
+        )
+
     def _check_interface (self, iface, is_wlan = False) :
         found = False
         for ip4 in iface.inet4 :
@@ -264,11 +280,11 @@ class Status (Soup_Client) :
 
 class Freifunk (autosuper) :
 
-    def __init__ (self, site, request, url = None) :
+    def __init__ (self, site, request, url = None, session = None) :
         self.site    = site
         self.request = request
         if 'interfaces' in self.request or 'ips' in self.request :
-            st = Status (site = self.site, url = url)
+            st = Status (site = self.site, url = url, session = session)
             self.request ['ips']        = st.ips
             self.request ['interfaces'] = st.if_by_name
             self.request ['version']    = st.version
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# #*** <License> ************************************************************#
+# This module is part of the repository CNDB.
+#
+# This module is licensed under the terms of the BSD 3-Clause License
+# <http://www.c-tanzer.at/license/bsd_3c.html>.
+# #*** </License> ***********************************************************#
+
+from   _TFL.pyk           import pyk
+
+import os
+import pickle
+import struct
+import zlib
+from   gzip               import GzipFile
+from   rsclib.autosuper   import autosuper
+
+magic  = b'FF-Spider-Journal 1\n'
+header = struct.Struct ('>I')
+
+def open_dump (filename, mode = 'rb') :
+    """ Open a dump or journal, gzip-compressed if the name ends in .gz
+    """
+    if filename.endswith ('.gz') :
+        return GzipFile (filename, mode, 9)
+    return open (filename, mode)
+# end def open_dump
+
+def add_suffix (filename, suffix) :
+    """ Append suffix to filename, before a final .gz """
+    if filename.endswith ('.gz') :
+        return filename [:-3] + suffix + '.gz'
+    return filename + suffix
+# end def add_suffix
+
+def read_records (f) :
+    """ Read length-prefixed pickle records from f until end of file.
+        A truncated last record (e.g. from a killed spider run) ends
+        the journal silently, all complete records are returned.
+    """
+    results = {}
+    while True :
+        try :
+            h = f.read (header.size)
+            if len (h) < header.size :
+                break
+            n,   = header.unpack (h)
+            data = f.read (n)
+            if len (data) < n :
+                break
+            ip, result = pickle.loads (data)
+        except (EOFError, IOError, zlib.error, pickle.UnpicklingError) :
+            break
+        results [ip] = result
+    return results
+# end def read_records
+
+def load_dump (filename) :
+    """ Load a pickle dump or a journal written by `Journal`, both
+        return a dictionary of results indexed by IP.
+    """
+    f = open_dump (filename)
+    try :
+        if f.read (len (magic)) == magic :
+            return read_records (f)
+        f.seek (0)
+        return pickle.load (f)
+    finally :
+        f.close ()
+# end def load_dump
+
+class Journal (autosuper) :
+    """ Append-only log of spider results, each result is written as
+        soon as it is known. With `resume` the complete records of an
+        existing journal are preloaded into `results` and written to
+        the new journal before it replaces the old one. Otherwise an
+        existing journal (of an interrupted run) is kept with `.old`
+        appended to its name, replacing an earlier `.old` journal.
+    """
+
+    protocol = 2
+
+    def __init__ (self, filename, resume = False) :
+        self.filename = filename
+        self.results  = {}
+        if os.path.exists (filename) :
+            if resume :
+                self.results = load_dump (filename)
+            else :
+                os.rename (filename, add_suffix (filename, '.old'))
+        tmp    = add_suffix (filename, '.new')
+        self.f = open_dump (tmp, 'wb')
+        self.f.write (magic)
+        for ip, result in pyk.iteritems (self.results) :
+            self._write (ip, result)
+        self.f.flush ()
+        os.rename (tmp, filename)
+    # end def __init__
+
+    def append (self, ip, result) :
+        self._write (ip, result)
+        self.f.flush ()
+    # end def append
+
+    def close (self, remove = False) :
+        self.f.close ()
+        if remove :
+            os.unlink (self.filename)
+    # end def close
+
+    def _write (self, ip, result) :
+        data = pickle.dumps ((ip, result), self.protocol)
+        self.f.write (header.pack (len (data)))
+        self.f.write (data)
+    # end def _write
+
+# end class Journal
@@ -10,9 +10,41 @@
 from rsclib.autosuper import autosuper
 
 class Version_Mixin (autosuper) :
+    """ Version info of Luci pages: The handlers are registered with a
+        `Visitor` by `register_version`, after the visit `set_version`
+        computes the version from the collected elements.
+    """
     version      = "Unknown"
     luci_version = bf_version = None
 
+    def register_version (self, visitor) :
+        self.last_p    = None
+        self.footer    = None
+        self.luci_a    = None
+        self.powered_a = None
+        visitor.register ('div',    self.try_get_version)
+        visitor.register ('p',      self.version_p)
+        visitor.register ('footer', self.version_footer)
+        visitor.register ('a',      self.version_a)
+    # end def register_version
+
+    def version_p (self, p) :
+        self.last_p = p
+    # end def version_p
+
+    def version_footer (self, footer) :
+        if self.footer is None :
+            self.footer = footer
+    # end def version_footer
+
+    def version_a (self, a) :
+        href = a.get ('href')
+        if self.luci_a is None and href == 'http://luci.subsignal.org/' :
+            self.luci_a = a
+        if self.powered_a is None and a.string == 'Powered by LuCI' :
+            self.powered_a = a
+    # end def version_a
+
     def try_get_version (self, div) :
         if 'footer' in (div.get ('class') or []) :
             for p in div.find_all ("p") :
@@ -46,26 +78,19 @@ class Version_Mixin (autosuper) :
                 self.bf_version = v
     # end def try_get_version
 
-    def set_version (self, root) :
+    def set_version (self) :
         lv = self.luci_version
         if lv is None :
-            p  = None
-            ps = root.find_all ("p")
-            if ps :
-                p = ps [-1]
+            p = self.last_p
             if p and p.name and 'luci' in (p.get ('class') or []) :
                 lv = self.luci_version = ' '.join (p.stripped_strings)
         # New 2014-Beta (sic) backfire has changed the version info :-(
         if lv is None :
-            footer = None
-            a = None
-            a = root.find ("a", href = 'http://luci.subsignal.org/')
-            if a is None :
-                footer = root.find ('footer')
-                if footer :
-                    a = footer.find ('a')
+            a = self.luci_a
+            if a is None and self.footer :
+                a = self.footer.find ('a')
             if a is None :
-                a = root.find ("a", string = 'Powered by LuCI')
+                a = self.powered_a
             if a is not None :
                 if a.string.startswith ("Powered by LuCI") :
                     self.luci_version = lv = a.string
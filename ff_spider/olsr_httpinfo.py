@@ -7,6 +7,7 @@
 # <http://www.c-tanzer.at/license/bsd_3c.html>.
 # #*** </License> ***********************************************************#
 
+from   bs4                import SoupStrainer
 from   rsclib.autosuper   import autosuper
 from   ff_spider.common   import Interface, Inet4, Inet6, Soup_Client
 
@@ -15,6 +16,9 @@ class Config (Soup_Client) :
     retries = 2
     timeout = 10
 
+    cache_attrs = ('if_by_name', 'ips', 'version')
+    parse_only  = SoupStrainer ('div', id = 'maintable')
+
     def append_iface (self, n, name, ** kw) :
         iface = Interface (n, name, kw ['mtu'])
         i4 = Inet4 (iface = name, ** kw)
@@ -71,12 +75,12 @@ class Config (Soup_Client) :
 
 class OLSR (autosuper) :
 
-    def __init__ (self, site, request, url = None) :
+    def __init__ (self, site, request, url = None, session = None) :
         self.site    = site
         self.url     = url
         self.request = request
         if 'interfaces' in self.request or 'ips' in self.request :
-            cfg = Config (site = self.site, url = url)
+            cfg = Config (site = self.site, url = url, session = session)
             self.request ['ips']        = cfg.ips
             self.request ['interfaces'] = cfg.if_by_name
             self.request ['version']    = cfg.version
@@ -9,9 +9,11 @@
 
 from   _TFL.pyk           import pyk
 
+from   bs4                import SoupStrainer
 from   rsclib.autosuper   import autosuper
 from   ff_spider.common   import Interface, Inet4, Inet6, unroutable
-from   ff_spider.common   import WLAN_Config, Soup_Client
+from   ff_spider.common   import WLAN_Config, Soup_Client, fetch_pages
+from   ff_spider.common   import Visitor
 from   ff_spider.luci     import Version_Mixin
 
 class Status (Soup_Client, Version_Mixin) :
@@ -27,16 +29,18 @@ class Status (Soup_Client, Version_Mixin) :
         , mode    = 'mode'
         )
 
+    cache_attrs = ('wlans', 'routes', 'version', 'luci_version', 'bf_version')
+
     def parse (self) :
         self.wlans  = []
         self.routes = {}
-        for div in self.soup.find_all ("div") :
-            id = div.get ('id')
-            if id == 'cbi-wireless' :
-                wlan_div = div
-            elif id == 'cbi-routes' :
-                route_div = div
-            self.try_get_version (div)
+        self.divs   = {}
+        visitor = Visitor ()
+        visitor.register ('div', self.section_div)
+        self.register_version (visitor)
+        visitor.visit (self.soup)
+        wlan_div  = self.divs ['cbi-wireless']
+        route_div = self.divs ['cbi-routes']
         for d in self.tbl_iter (wlan_div) :
             for k, newkey in pyk.iteritems (self.wl_names) :
                 if k in d :
@@ -48,9 +52,15 @@ class Status (Soup_Client, Version_Mixin) :
             gw    = d.get ('gateway')
             if iface and gw :
                 self.routes [iface] = gw
-        self.set_version (self.soup)
+        self.set_version ()
     # end def parse
 
+    def section_div (self, div) :
+        id = div.get ('id')
+        if id in ('cbi-wireless', 'cbi-routes') :
+            self.divs [id] = div
+    # end def section_div
+
     def tbl_iter (self, div) :
         tbl = div.find ("table")
         assert 'cbi-section-table' in tbl.get ('class')
@@ -71,6 +81,8 @@ class Status (Soup_Client, Version_Mixin) :
 
 class Table_Iter (Soup_Client) :
 
+    parse_only = SoupStrainer ('div', id = 'maincontent')
+
     def table_iter (self) :
         div = self.soup.find ("div", id = 'maincontent')
         tbl = div.find ("table")
@@ -92,6 +104,7 @@ class OLSR_Connections (Table_Iter) :
     retries      = 2
     timeout      = 10
     html_charset = 'utf-8' # force utf-8 encoding
+    cache_attrs  = ('neighbors',)
 
     def parse (self) :
         self.neighbors = {}
@@ -108,6 +121,7 @@ class OLSR_Routes (Table_Iter) :
     retries      = 2
     timeout      = 10
     html_charset = 'utf-8' # force utf-8 encoding
+    cache_attrs  = ('iface_by_gw',)
 
     def parse (self) :
         self.iface_by_gw = {}
@@ -123,13 +137,16 @@ class OLSR_Routes (Table_Iter) :
 
 class OpenWRT (autosuper) :
 
-    def __init__ (self, site, request) :
+    pages = dict (st = Status, conn = OLSR_Connections, route = OLSR_Routes)
+
+    def __init__ (self, site, request, session = None) :
         self.site    = site
         self.request = request
         if 'interfaces' in self.request or 'ips' in self.request :
-            st    = Status           (site = site)
-            conn  = OLSR_Connections (site = site)
-            route = OLSR_Routes      (site = site)
+            p     = fetch_pages (self.pages, site = site, session = session)
+            st    = p ['st']
+            conn  = p ['conn']
+            route = p ['route']
             self.version = st.version
             assert len (st.wlans) <= 1
             interfaces   = {}
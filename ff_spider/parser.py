@@ -23,20 +23,32 @@ from   bs4                     import BeautifulSoup
 from   rsclib.stateparser      import Parser
 from   rsclib.autosuper        import autosuper
 from   rsclib.IP_Address       import IP4_Address
+from   rsclib.timeout          import Timeout_Error
 from   ff_spider.freifunk      import Freifunk
 from   ff_spider.olsr_httpinfo import OLSR
 from   ff_spider.backfire      import Backfire
 from   ff_spider.openwrt       import OpenWRT
 from   ff_spider.routeros      import Router_OS
+from   ff_spider.journal       import load_dump
 from   argparse                import ArgumentParser
 
+try :
+    from html                  import unescape
+except ImportError :
+    from HTMLParser            import HTMLParser
+    unescape = HTMLParser ().unescape
+
 # for pickle
 from   ff_spider.common        import Interface, Net_Link, Inet4, Inet6
 from   ff_spider.common        import Compare_Mixin, Soup_Client, WLAN_Config
+from   ff_spider.common        import Session, Visitor
 from   ff_spider.freifunk      import Interface_Config, WLAN_Config_Freifunk
 
 site_template = 'http://%(ip)s'
 
+class Ambiguous_Page (ValueError) :
+    """ The backend can't be decided from the raw bytes of a page """
+
 class First_Guess (Soup_Client) :
     url     = ''
     delay   = 0
@@ -46,35 +58,211 @@ class First_Guess (Soup_Client) :
     status_url = 'cgi-bin-status.html'
     status_ok  = 0
 
-    def __init__ (self, rqinfo, site, url, port = 0) :
+    def __init__ (self, rqinfo, site, url, port = 0, session = None) :
         self.rqinfo = rqinfo
         if port :
             site = "%s:%s" % (site, port)
         self.params = dict (request = self.rqinfo, site = site)
-        self.__super.__init__ (site = site, url = url)
+        self.__super.__init__ (site = site, url = url, session = session)
     # end def __init__
 
+    fingerprint_tags = ('title', 'meta', 'big', 'a', 'td', 'form')
+
+    # Comments and scripts are not searched for the byte signatures.
+    # They are replaced by an empty comment: For the soup the text of a
+    # tag interrupted by one is no plain string either.
+    re_ignore = re.compile \
+        (br'<!--.*?-->|<(script|style)\b.*?</\1\s*>', re.I | re.S)
+    re_tag    = re.compile \
+        (br'<(title|meta|big|a|td|form)(?=[\s/>])([^>]*)>', re.I)
+    re_attr   = re.compile \
+        (br'''([^\s=/>]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]*))?''')
+    re_text   = re.compile (br'([^<]*)</([a-zA-Z]+)\s*>')
+    re_entity = re.compile \
+        (br'&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);')
+    fp_olsr   = b'olsr.org httpinfo plugin'
+    ignored   = b'<!---->'
+
+    def parse_content (self, content) :
+        """ Only pages not recognized by `fingerprint` are parsed """
+        if not self.fingerprint (content) :
+            self.__super.parse_content (content)
+    # end def parse_content
+
+    def fingerprint (self, content) :
+        """ Decide the backend from the raw bytes of the page with the
+            signatures of the trials of `parse`. Returns False if the
+            page is ambiguous or unknown, it is then parsed as usual.
+        """
+        try :
+            guess = self.byte_guess (self.byte_tags (content))
+        except (Ambiguous_Page, UnicodeDecodeError) :
+            return False
+        if guess is None :
+            return False
+        self.backend, update = guess
+        self.params.update (update)
+        return True
+    # end def fingerprint
+
+    def byte_tags (self, content) :
+        """ The tags of `fingerprint_tags` by name in document order as
+            a list of (attrs, text, raw): The attributes by lowercase
+            name, the content if it is a plain string (else None) and
+            otherwise the raw content up to the next end tag of the same
+            name. Ignored parts are removed from the raw content, so that
+            signatures split by a comment are found. Entities are decoded
+            in both, see `byte_unescape`.
+        """
+        content = self.re_ignore.sub (self.ignored, content)
+        lower   = content.lower ()
+        tags    = dict ((n, []) for n in self.fingerprint_tags)
+        for m in self.re_tag.finditer (content) :
+            name  = m.group (1).lower ()
+            attrs = {}
+            for a in self.re_attr.finditer (m.group (2)) :
+                v = a.group (2) or b''
+                if v [:1] in (b'"', b"'") :
+                    v = v [1:-1]
+                attrs [a.group (1).lower ()] = v
+            text = raw = None
+            if name in (b'title', b'a', b'td') :
+                t = self.re_text.match (content, m.end ())
+                if t and t.group (2).lower () == name :
+                    text = self.byte_unescape (t.group (1))
+                else :
+                    end = lower.find (b'</' + name, m.end ())
+                    raw = content [m.end () : end if end >= 0 else None]
+                    raw = self.byte_unescape (raw.replace (self.ignored, b''))
+            tags [name.decode ('ascii')].append ((attrs, text, raw))
+        return tags
+    # end def byte_tags
+
+    def byte_unescape (self, s) :
+        """ Decode the entities of s. The result is only compared to the
+            ASCII signatures, so other characters needn't survive.
+        """
+        if b'&' not in s :
+            return s
+        if b'&' in self.re_entity.sub (b'', s) :
+            raise Ambiguous_Page ("Ampersand without entity")
+        return unescape (s.decode ('latin-1')).encode ('utf-8')
+    # end def byte_unescape
+
+    def byte_attr (self, attrs, name) :
+        v = attrs.get (name)
+        if v is not None and b'&' in v :
+            raise Ambiguous_Page ("Entity in attribute %r" % name)
+        return v
+    # end def byte_attr
+
+    def byte_guess (self, tags) :
+        """ Backend and update of params from the tags found by
+            `byte_tags`, following the trials of `parse`. Returns None
+            for an unknown frontend. Raises `Ambiguous_Page` if the
+            soup might come to a different conclusion.
+        """
+        if tags ['title'] :
+            attrs, text, raw = tags ['title'][0]
+            if text is not None and text.strip () == self.fp_olsr :
+                return 'OLSR', dict (site = self.url)
+            if self.fp_olsr in (raw if text is None else text) :
+                raise Ambiguous_Page ("OLSR title")
+        for attrs, text, raw in tags ['meta'] :
+            if self.byte_attr (attrs, b'http-equiv') == b'refresh' :
+                c = self.byte_attr (attrs, b'content')
+                if c and c.endswith (b'cgi-bin/luci') :
+                    return 'Luci', {}
+                elif c and c.endswith (b'URL=/cgi-bin-index.html') :
+                    return 'Freifunk', {}
+        backend = None
+        for attrs, text, raw in tags ['big'] :
+            cls = self.byte_attr (attrs, b'class')
+            if cls is None :
+                raise Ambiguous_Page ("big without class")
+            if b'plugin' in cls.split () :
+                backend = 'Freifunk'
+                break
+        status_url = self.status_url
+        status_ok  = self.status_ok
+        for attrs, text, raw in tags ['a'] :
+            cls = self.byte_attr (attrs, b'class')
+            if not cls or b'plugin' not in cls.split () :
+                continue
+            if text is None :
+                if b'Status' in raw :
+                    raise Ambiguous_Page ("Status link")
+                continue
+            href = self.byte_attr (attrs, b'href')
+            if href is not None :
+                href = href.decode ('ascii')
+            if text == b'Status klassisch' :
+                status_url = href
+                status_ok  = 1
+            elif text == b'Status' and not status_ok :
+                status_url = href
+        update = dict (url = status_url)
+        if backend :
+            return backend, update
+        score = 0
+        for attrs, text, raw in tags ['td'] :
+            if text is None :
+                if any (k in raw for k in self.router_os_bytes) :
+                    raise Ambiguous_Page ("Router_OS score")
+                continue
+            score += self.router_os_bytes.get (text, 0)
+            if score > 3 :
+                break
+        else :
+            for attrs, text, raw in tags ['form'] :
+                if self.byte_attr (attrs, b'action') == b'/login.cgi' :
+                    update.update (url = 'cgi-bin/index.sh')
+                    break
+            else :
+                return None
+        for attrs, text, raw in tags ['a'] :
+            if text is None :
+                if b'OLSR-Routen' in raw :
+                    raise Ambiguous_Page ("OLSR-Routen link")
+                continue
+            if text in (b'OLSR-Routen', b'OLSR-Routen (IPv4)') :
+                href = self.byte_attr (attrs, b'href')
+                if href is None :
+                    raise Ambiguous_Page ("OLSR-Routen without href")
+                update.update (url = href.split (b'?') [0].decode ('ascii'))
+                break
+        return 'Router_OS', update
+    # end def byte_guess
+
     def parse (self) :
+        """ Collect the tags of all trials in a single walk of the
+            page, the trials then only look at the collected tags.
+        """
         self.backend = None
-        title = self.soup.title
+        self.tags    = dict ((n, []) for n in self.fingerprint_tags)
+        visitor      = Visitor ()
+        for name in self.fingerprint_tags :
+            visitor.register (name, self.tags [name].append)
+        visitor.visit (self.soup)
+        title = self.tags ['title'][0] if self.tags ['title'] else None
         t     = 'olsr.org httpinfo plugin'
         if title is not None and title.string and title.string.strip () == t :
             self.backend = 'OLSR'
             self.params.update (site = self.url)
         for trial in self.try_luci, self.try_freifunk, self.try_router_os :
             if not self.backend :
-                trial (self.soup)
+                trial (self.tags)
         if not self.backend :
             raise ValueError ("Unknown Web Frontend")
     # end def parse
 
-    def try_freifunk (self, root) :
-        for big in root.find_all ("big") :
+    def try_freifunk (self, tags) :
+        for big in tags ["big"] :
             if 'plugin' in big.get ('class') :
                 self.backend = "Freifunk"
                 break
         # Best effort to find status url
-        for a in root.find_all ("a") :
+        for a in tags ["a"] :
             if a.get ('class') and 'plugin' in a.get ('class') :
                 # Allow 'Status klassisch' to override status
                 # even if found first
@@ -86,8 +274,8 @@ class First_Guess (Soup_Client) :
         self.params.update (url = self.status_url)
     # end def try_freifunk
 
-    def try_luci (self, root) :
-        for meta in root.find_all ("meta") :
+    def try_luci (self, tags) :
+        for meta in tags ["meta"] :
             if meta.get ('http-equiv') == 'refresh' :
                 c = meta.get ('content')
                 if c and c.endswith ('cgi-bin/luci') :
@@ -107,24 +295,28 @@ class First_Guess (Soup_Client) :
         , 'Uptime:'        :   1
         , 'Interface'      :   1
         }
+    router_os_bytes = dict \
+        ( (k.encode ('ascii'), v)
+          for k, v in pyk.iteritems (router_os_scores)
+        )
 
-    def try_router_os (self, root) :
+    def try_router_os (self, tags) :
         score = 0
-        for td in root.find_all ("td") :
+        for td in tags ["td"] :
             if td.string in self.router_os_scores :
                 score += self.router_os_scores [td.string]
             if score > 3 :
                 self.backend = 'Router_OS'
                 break
         else :
-            for form in root.find_all ("form") :
+            for form in tags ["form"] :
                 if form.get ('action') == "/login.cgi" :
                     self.backend = 'Router_OS'
                     self.params.update (url = 'cgi-bin/index.sh')
                     break
             else :
                 return
-        for a in root.find_all ("a") :
+        for a in tags ["a"] :
             if a.string in ('OLSR-Routen', 'OLSR-Routen (IPv4)') :
                 self.params.update (url = a.get ('href').split ('?') [0])
                 break
@@ -139,10 +331,10 @@ class Luci_Guess (Soup_Client) :
     url          = 'cgi-bin/luci'
     html_charset = 'utf-8' # force utf-8 encoding
 
-    def __init__ (self, rqinfo, site, url = None) :
+    def __init__ (self, rqinfo, site, url = None, session = None) :
         self.rqinfo = rqinfo
         self.params = dict (request = self.rqinfo, site = site)
-        self.__super.__init__ (site = site, url = url)
+        self.__super.__init__ (site = site, url = url, session = session)
     # end def __init__
 
     def parse (self) :
@@ -172,18 +364,46 @@ class Guess (Compare_Mixin) :
         , Router_OS = Router_OS
         )
 
-    def __init__ (self, site, ip, url = None, port = 0) :
+    def __init__ \
+        ( self, site, ip
+        , url         = None
+        , port        = 0
+        , session     = None
+        , fingerprint = None
+        ) :
+        """ All pages of the node are fetched via the given `Session`
+            (a new one if not given), it is not stored in the Guess.
+            A `fingerprint` is a tuple of backend and params from an
+            earlier run: The backend is tried directly, if it fails for
+            other reasons than an unreachable node, we fall back to
+            detecting the web frontend.
+        """
         self.version = "Unknown"
-        self.rqinfo  = dict.fromkeys (('ips', 'interfaces'))
-        self.rqinfo ['ip'] = ip
-        g = First_Guess (self.rqinfo, site, url, port)
-        self.params  = g.params
-        self.backend = g.backend
-        if self.backend == 'Luci' :
-            g2  = Luci_Guess (self.rqinfo, self.params ['site'])
-            self.params  = g2.params
-            self.backend = g2.backend
-        self.status  = self.backend_table [self.backend] (** self.params)
+        self.status  = None
+        session = session or Session ()
+        if fingerprint :
+            self.backend, params = fingerprint
+            self.rqinfo = self.new_rqinfo (ip)
+            self.params = dict (params, request = self.rqinfo)
+            try :
+                self.status = self.backend_table [self.backend] \
+                    (session = session, ** self.params)
+            except (Timeout_Error, requests.exceptions.ConnectionError) :
+                raise
+            except Exception :
+                self.status = None
+        if self.status is None :
+            self.rqinfo = self.new_rqinfo (ip)
+            g = First_Guess (self.rqinfo, site, url, port, session = session)
+            self.params  = g.params
+            self.backend = g.backend
+            if self.backend == 'Luci' :
+                g2  = Luci_Guess \
+                    (self.rqinfo, self.params ['site'], session = session)
+                self.params  = g2.params
+                self.backend = g2.backend
+            self.status  = self.backend_table [self.backend] \
+                (session = session, ** self.params)
         try :
             self.version = self.rqinfo ['version']
         except KeyError :
@@ -192,6 +412,13 @@ class Guess (Compare_Mixin) :
         self.time = datetime.utcnow ()
     # end def __init__
 
+    @staticmethod
+    def new_rqinfo (ip) :
+        rqinfo = dict.fromkeys (('ips', 'interfaces'))
+        rqinfo ['ip'] = ip
+        return rqinfo
+    # end def new_rqinfo
+
     def as_json (self) :
         d = dict (type = self.type, version = self.version)
         iface = d ['interfaces'] = []
@@ -254,6 +481,14 @@ def main () :
         , action  = "store_true"
         , help    = "Debug merging of pickle dumps"
         )
+    cmd.add_argument \
+        ( "-H", "--html-parser"
+        , dest    = "html_parser"
+        , help    = "HTML parser for spidered IPs, one of %(choices)s, "
+                    "default: %(default)s"
+        , choices = ('html.parser', 'lxml')
+        , default = 'html.parser'
+        )
     cmd.add_argument \
         ( "-l", "--local"
         , dest    = "local"
@@ -311,14 +546,10 @@ def main () :
         keys = dict.fromkeys (pyk.iterkeys (ipdict))
         mt   = None
         if fn == '-' :
-            f = sys.stdin
+            obj = pickle.load (sys.stdin)
         else :
-            mt = datetime.utcfromtimestamp (os.stat (fn) [ST_MTIME])
-            if fn.endswith ('.gz') :
-                f = GzipFile (fn, 'r')
-            else :
-                f = open (fn, 'r')
-        obj = pickle.load (f)
+            mt  = datetime.utcfromtimestamp (os.stat (fn) [ST_MTIME])
+            obj = load_dump (fn)
         for k, v in pyk.iteritems (obj) :
             # Fixup of object
             if isinstance (v, Guess) :
@@ -337,7 +568,7 @@ def main () :
                     overwrite = False
                     if not istuple :
                         overwrite = True
-                    elif ov [0] == 'Timeout_Error' :
+                    elif ov [0] in ('Timeout_Error', 'Unreachable') :
                         overwrite = True
                     elif v [0] == 'ValueError' :
                         overwrite = True
@@ -378,7 +609,13 @@ def main () :
         if opt.local :
             site = 'file://' + os.path.abspath (ip)
             url  = 'index.html'
-        ff = Guess (site = site, ip = ip, url = url, port = port)
+        ff = Guess \
+            ( site    = site
+            , ip      = ip
+            , url     = url
+            , port    = port
+            , session = Session (parser = opt.html_parser)
+            )
         print (ff.verbose_repr ())
         ipdict [str (ip)] = ff
     if opt.output_pickle :
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# #*** <License> ************************************************************#
+# This module is part of the repository CNDB.
+#
+# This module is licensed under the terms of the BSD 3-Clause License
+# <http://www.c-tanzer.at/license/bsd_3c.html>.
+# #*** </License> ***********************************************************#
+
+import errno
+import select
+import socket
+import time
+
+# connect_ex results of a connect that is still in progress
+in_progress = (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY)
+
+# A refused connection shows that the node is up, the spider will get a
+# quick error for it, no need to treat it as unreachable.
+alive_errors = (0, errno.ECONNREFUSED)
+
+def presweep (addresses, timeout = 3, parallel = 256) :
+    """ Probe all (ip, port) tuples in addresses with a non-blocking
+        TCP connect, at most `parallel` probes are in flight. Returns
+        the set of addresses that answered within `timeout` seconds.
+    """
+    addresses = iter (addresses)
+    alive     = set ()
+    pending   = {}
+    while True :
+        for addr in addresses :
+            s = socket.socket (socket.AF_INET, socket.SOCK_STREAM)
+            s.setblocking (0)
+            err = s.connect_ex (addr)
+            if err in in_progress :
+                pending [s] = (addr, time.time () + timeout)
+            else :
+                if err in alive_errors :
+                    alive.add (addr)
+                s.close ()
+            if len (pending) >= parallel :
+                break
+        if not pending :
+            break
+        now  = time.time ()
+        wait = max (0, min (d for a, d in pending.values ()) - now)
+        r, w, x = select.select ([], list (pending), [], wait)
+        for s in w :
+            addr, d = pending.pop (s)
+            err     = s.getsockopt (socket.SOL_SOCKET, socket.SO_ERROR)
+            if err in alive_errors :
+                alive.add (addr)
+            s.close ()
+        now = time.time ()
+        for s, (addr, d) in list (pending.items ()) :
+            if d <= now :
+                del pending [s]
+                s.close ()
+    return alive
+# end def presweep
@@ -11,14 +11,17 @@ from   __future__         import print_function
 
 from   _TFL.pyk           import pyk
 
+from   bs4                import SoupStrainer
 from   rsclib.autosuper   import autosuper
 from   ff_spider.common   import Interface, Inet4, unroutable, Soup_Client
-from   ff_spider.common   import Parse_Error
+from   ff_spider.common   import Parse_Error, fetch_pages
 
 class Routes (Soup_Client) :
     retries      = 2
     timeout      = 10
     url          = '/cgi-bin/index.cgi?post_routes=1'
+    cache_attrs  = ('ip_dev', 'version')
+    parse_only   = SoupStrainer (['pre', 'small'])
 
     def parse (self) :
         self.ip_dev = {}
@@ -58,6 +61,8 @@ class Details (Soup_Client) :
     retries      = 2
     timeout      = 10
     url          = '/cgi-bin/index.cgi?post_olsr=1'
+    cache_attrs  = ('ip_dev', 'gw_ip', 'metric')
+    parse_only   = SoupStrainer ('pre')
 
     def parse (self) :
         self.ip_dev = {}
@@ -106,15 +111,20 @@ class Router_OS (autosuper) :
 
     url = '/cgi-bin/index.cgi?post_routes=1'
 
-    def __init__ (self, site, request, url = url) :
+    def __init__ (self, site, request, url = url, session = None) :
         self.site    = site
         self.request = request
         rtparm = 1
         if url.endswith ('cgi') :
             rtparm = 2
         if 'interfaces' in self.request or 'ips' in self.request :
-            rt = Routes  (site = site, url = url + '?post_routes=%s' % rtparm)
-            dt = Details (site = site, url = url + '?post_olsr=1')
+            pages = dict \
+                ( rt = (Routes,  dict (url = url + '?post_routes=%s' % rtparm))
+                , dt = (Details, dict (url = url + '?post_olsr=1'))
+                )
+            p  = fetch_pages (pages, site = site, session = session)
+            rt = p ['rt']
+            dt = p ['dt']
             if not getattr (rt, 'version', None) :
                 raise Parse_Error ('No version, probably login of router-os')
             self.version = rt.version
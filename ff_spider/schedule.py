@@ -0,0 +1,285 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# #*** <License> ************************************************************#
+# This module is part of the repository CNDB.
+#
+# This module is licensed under the terms of the BSD 3-Clause License
+# <http://www.c-tanzer.at/license/bsd_3c.html>.
+# #*** </License> ***********************************************************#
+
+from   _TFL.pyk           import pyk
+
+import hashlib
+import time
+from   collections        import deque
+from   heapq              import heappush, heappop
+from   rsclib.autosuper   import autosuper
+from   ff_spider.cache    import load_state, save_state
+
+def get_topology (olsr) :
+    """ Undirected adjacency of the OLSR topology: dictionary of the
+        neighbours of each node by IP (as string).
+    """
+    topology = {}
+    for table in olsr.topo.forward, olsr.topo.reverse :
+        for ip, neighbours in pyk.iteritems (table) :
+            ip = str (ip)
+            topology.setdefault (ip, set ())
+            for n in neighbours :
+                n = str (n)
+                topology [ip].add (n)
+                topology.setdefault (n, set ()).add (ip)
+    return topology
+# end def get_topology
+
+def get_aliases (olsr) :
+    """ Main address by alias (as strings) from the MID table of the
+        OLSR container, empty if it has none. In the MID table of
+        ff_olsr, `by_ip` maps the main address of a node to its
+        aliases.
+    """
+    mid = getattr (olsr, 'mid', None)
+    if mid is None :
+        return {}
+    aliases = {}
+    for main, alias in pyk.iteritems (mid.by_ip) :
+        for a in alias :
+            if str (a) != str (main) :
+                aliases [str (a)] = str (main)
+    return aliases
+# end def get_aliases
+
+def last_hop (topology, ip) :
+    """ The neighbour of ip with the most links: Most likely the node
+        providing the radio link that ip is reached over. Nodes
+        without neighbours are their own link.
+    """
+    neighbours = topology.get (ip)
+    if not neighbours :
+        return ip
+    return max (neighbours, key = lambda n : (len (topology [n]), n))
+# end def last_hop
+
+def shard_index (ip, n) :
+    """ Index of the shard of ip when partitioning the nodes into n
+        shards. Unlike `hash` this is the same in all processes, runs
+        and hosts.
+    """
+    return int (hashlib.md5 (str (ip).encode ('ascii')).hexdigest (), 16) % n
+# end def shard_index
+
+class Scheduler (autosuper) :
+    """ Hand out spider tasks so that concurrent requests don't all
+        queue on the same radio link: Tasks are grouped by the last hop
+        of the node and handed out round-robin over the groups, at most
+        `per_link` nodes of a group are in flight (0 means no limit).
+        Tasks of discarded nodes are dropped when they come up. A
+        paused link hands out no tasks until the pause ends, then only
+        one at a time until it is resumed.
+    """
+
+    def __init__ (self, topology, per_link = 0) :
+        self.topology  = topology
+        self.per_link  = per_link
+        self.queues    = {}
+        self.links     = deque ()
+        self.link      = {}
+        self.running   = {}
+        self.discarded = set ()
+        self.paused    = {}
+        self.started   = {}
+        self.in_flight = 0
+    # end def __init__
+
+    def __len__ (self) :
+        return sum (len (self.queued (l)) for l in self.queues)
+    # end def __len__
+
+    def add (self, ip, task) :
+        link = self.link [ip] = last_hop (self.topology, ip)
+        if link not in self.queues :
+            self.queues  [link] = deque ()
+            self.running [link] = 0
+            self.links.append (link)
+        self.queues [link].append ((ip, task))
+    # end def add
+
+    def discard (self, ip) :
+        """ Don't hand out the task of ip if it is still queued """
+        self.discarded.add (ip)
+    # end def discard
+
+    def pause (self, link, until) :
+        self.paused [link] = until
+    # end def pause
+
+    def resume (self, link) :
+        self.paused.pop (link, None)
+    # end def resume
+
+    def queued (self, link) :
+        """ IPs of the tasks of link not handed out yet """
+        return [ip for ip, t in self.queues [link] if ip not in self.discarded]
+    # end def queued
+
+    def wait (self) :
+        """ Time in seconds until the next pause ends, pauses that
+            already ended are ignored.
+        """
+        now   = time.time ()
+        until = [t for t in pyk.itervalues (self.paused) if t > now]
+        if not until :
+            return 0
+        return min (until) - now
+    # end def wait
+
+    def next_task (self) :
+        """ Return next task or None if no task can be started now """
+        for n in range (len (self.links)) :
+            link  = self.links [0]
+            queue = self.queues [link]
+            self.links.rotate (-1)
+            while queue and queue [0][0] in self.discarded :
+                queue.popleft ()
+            if not queue :
+                continue
+            if self.per_link and self.running [link] >= self.per_link :
+                continue
+            if link in self.paused :
+                if time.time () < self.paused [link] or self.running [link] :
+                    continue
+            self.running [link] += 1
+            self.in_flight      += 1
+            ip, task = queue.popleft ()
+            self.started [ip] = time.time ()
+            return task
+        return None
+    # end def next_task
+
+    def done (self, ip) :
+        self.running [self.link [ip]] -= 1
+        self.in_flight                -= 1
+    # end def done
+
+# end class Scheduler
+
+class Circuit_Breaker (autosuper) :
+    """ Detect network segments that are down: When `threshold` nodes
+        behind the same link fail within `window` seconds without a
+        success in between, the link is paused for `window` seconds.
+        If after the pause the next node fails too, the link is down.
+        A success resumes the link.
+    """
+
+    def __init__ (self, threshold = 3, window = 60) :
+        self.threshold = threshold
+        self.window    = window
+        self.failures  = {}
+        self.paused    = {}
+    # end def __init__
+
+    def record (self, link, failed, started) :
+        """ Record result of a node behind link that was started at
+            time `started`. Returns 'pause', 'resume', 'down' or None.
+        """
+        now = time.time ()
+        if not failed :
+            self.failures.pop (link, None)
+            if self.paused.pop (link, None) is not None :
+                return 'resume'
+            return None
+        if link in self.paused :
+            # Nodes started before the pause ended don't count
+            if started >= self.paused [link] :
+                del self.paused [link]
+                return 'down'
+            return None
+        start = now - self.window
+        times = [t for t in self.failures.get (link, ()) if t > start]
+        times.append (now)
+        self.failures [link] = times
+        if len (times) >= self.threshold :
+            del self.failures [link]
+            self.paused [link] = now + self.window
+            return 'pause'
+        return None
+    # end def record
+
+# end class Circuit_Breaker
+
+class Revisit_Queue (autosuper) :
+    """ Priority queue of the next visit of each node for the daemon
+        mode. The interval between two visits of a node is `interval`
+        seconds divided by twice the rate of change of its result
+        (estimated from the visits so far): A node that changes on
+        every visit is visited twice as often, a node that rarely
+        changes less often. For each consecutive failure of a node the
+        interval is doubled. Intervals are limited to `min_interval`
+        and `max_interval`. The statistics by IP (visits, changes,
+        consecutive failures and time of next visit) are kept in
+        `filename` so that a restarted daemon continues the schedule.
+    """
+
+    def __init__ \
+        ( self, filename
+        , interval     = 3600
+        , min_interval = None
+        , max_interval = None
+        ) :
+        self.filename     = filename
+        self.interval     = interval
+        self.min_interval = min_interval or interval / 4.
+        self.max_interval = max_interval or interval * 24
+        self.stats        = load_state (filename, {})
+        self.heap         = []
+    # end def __init__
+
+    def add (self, ip, now = None) :
+        """ Schedule ip at its saved time of next visit or now """
+        due = now or time.time ()
+        if ip in self.stats :
+            due = self.stats [ip][3]
+        heappush (self.heap, (due, ip))
+    # end def add
+
+    def next_due (self) :
+        """ Time of the next visit or None if the queue is empty """
+        if self.heap :
+            return self.heap [0][0]
+        return None
+    # end def next_due
+
+    def pop_due (self, now) :
+        """ Return next ip due at time `now` or None """
+        if self.heap and self.heap [0][0] <= now :
+            return heappop (self.heap) [1]
+        return None
+    # end def pop_due
+
+    def visited (self, ip, changed, now = None) :
+        """ Record a visit of ip and schedule the next one, `changed`
+            is None for a failed visit, otherwise it tells if the
+            result differs from the previous one.
+        """
+        now = now or time.time ()
+        visits, changes, failures, due = self.stats.get (ip, (0, 0, 0, 0))
+        if changed is None :
+            failures += 1
+        else :
+            visits   += 1
+            changes  += bool (changed)
+            failures  = 0
+        # estimate with one changed and one unchanged visit added, so
+        # that a new node is visited every `interval` seconds
+        rate = (changes + 1.) / (visits + 2)
+        t    = self.interval / (2 * rate) * 2 ** min (failures, 16)
+        t    = min (max (t, self.min_interval), self.max_interval)
+        self.stats [ip] = (visits, changes, failures, now + t)
+        heappush (self.heap, (now + t, ip))
+    # end def visited
+
+    def save (self) :
+        save_state (self.filename, self.stats)
+    # end def save
+
+# end class Revisit_Queue
@@ -9,58 +9,187 @@ from   __future__      import print_function
 
 from   _TFL.pyk        import pyk
 
+import math
 import os
 import pickle
+import signal
 import sys
+import threading
+import time
 
 from argparse          import ArgumentParser
-from multiprocessing   import Pool, Manager
+from multiprocessing   import Pool, Process, Event
+from multiprocessing   import Queue as Process_Queue
 from rsclib.autosuper  import autosuper
 from rsclib.execute    import Log
 from rsclib.timeout    import Timeout, Timeout_Error
 from rsclib.IP_Address import IP4_Address
 from ff_olsr.parser    import get_olsr_container
 from ff_spider.parser  import Guess, site_template
+from ff_spider.journal import Journal, open_dump, load_dump
+from ff_spider.common  import Session
+from ff_spider.cache   import Fingerprint_Cache, Page_Cache, Latency_History
+from ff_spider.cache   import Topology_Cache, Negative_Cache, save_state
+from ff_spider.throttle import Throttle
+from ff_spider.schedule import Scheduler, get_topology, get_aliases
+from ff_spider.schedule import shard_index
+from ff_spider.schedule import Revisit_Queue, Circuit_Breaker
+from ff_spider.presweep import presweep
 from itertools         import islice
 from logging           import INFO
-from gzip              import GzipFile
+from requests.exceptions import ConnectionError
 
-def get_node_info \
-    (result_dict, ip, timeout = 180, ip_port = {}, debug = False) :
-    w = Worker \
-        (result_dict, ip, timeout = timeout, ip_port = ip_port, debug = debug)
+try :
+    from queue import Queue, Empty
+except ImportError :
+    from Queue import Queue, Empty
+
+# Throttle shared by all workers, set by init_worker in each process
+throttle = None
+
+def init_worker (t) :
+    global throttle
+    throttle = t
+    # Ctrl-C is handled by the parent: A worker killed by it while
+    # holding the lock of a task queue would hang the parent
+    signal.signal (signal.SIGINT, signal.SIG_IGN)
+# end def init_worker
+
+def get_node_info (ip, ** kw) :
+    """ Spider a single node, return tuple of ip, result and the info
+        of the worker (page cache entries and latency of the node).
+        This is streamed back to the parent via the return value of the
+        pool task or a queue, i.e., it is pickled: A result that can't
+        be pickled would get lost, it is replaced by an error.
+    """
+    w = Worker (ip, throttle = throttle, ** kw)
     try :
-        return w.get_node_info ()
+        result = w.get_node_info ()
+        pickle.dumps (result)
     except Exception as err :
-        self.log.error ("Error in IP %s:" % ip)
-        w.log.log_exception ()
+        w.log.error ("Error in IP %s:" % ip)
+        w.log_exception ()
+        result = ("ERROR", repr (err))
+    return ip, result, w.info ()
 # end def get_node_info
 
+def get_node_info_args (args) :
+    """ Spider task (ip, kw) of a worker: Every task must return an
+        entry, otherwise the spider waits for it forever.
+    """
+    ip, kw = args
+    try :
+        return get_node_info (ip, ** kw)
+    except Exception as err :
+        return ip, ("ERROR", repr (err)), None
+# end def get_node_info_args
+
+def thread_worker (tasks, results, t, threads) :
+    """ Worker process of the threads engine: Start `threads` threads
+        that spider the nodes from the tasks queue and put the results
+        into the results queue until they get None.
+    """
+    init_worker (t)
+    def run () :
+        while True :
+            task = tasks.get ()
+            if task is None :
+                break
+            ip, kw = task
+            results.put \
+                (get_node_info_args ((ip, dict (kw, use_alarm = False))))
+    workers = [threading.Thread (target = run) for n in range (threads)]
+    for w in workers :
+        w.start ()
+    for w in workers :
+        w.join ()
+# end def thread_worker
+
+def shard_worker (index, shards, results, finished, t, threads) :
+    """ Worker process of the hybrid engine: Start `threads` threads
+        that spider the nodes from shard `index` of the task queues
+        (stealing from other shards when it is empty) and put the
+        results into the results queue until `finished` is set.
+    """
+    init_worker (t)
+    pending = Shard_Queue (index, shards, finished)
+    def run () :
+        while True :
+            task = pending.get ()
+            if task is None :
+                break
+            ip, kw = task
+            results.put \
+                (get_node_info_args ((ip, dict (kw, use_alarm = False))))
+    workers = [threading.Thread (target = run) for n in range (threads)]
+    for w in workers :
+        w.start ()
+    for w in workers :
+        w.join ()
+# end def shard_worker
+
 class Worker (Log, Timeout) :
 
     def __init__ \
         ( self
-        , result_dict
         , ip
         , timeout = 180
         , ip_port = {}
         , debug = False
+        , use_alarm = True
+        , fingerprint = None
+        , pages = None
+        , throttle = None
+        , min_gap = 0
+        , parser = 'html.parser'
         , **kw
         ) :
         self.__super.__init__ (** kw)
         self.ip          = ip
-        self.result_dict = result_dict
         self.timeout     = timeout
         self.ip_port     = ip_port
+        self.use_alarm   = use_alarm
+        self.fingerprint = fingerprint
+        self.duration    = None
+        self.armed       = False
+        self.session     = Session \
+            ( pages    = pages
+            , throttle = throttle
+            , min_gap  = min_gap
+            , parser   = parser
+            )
         if not debug :
             self.log.setLevel (INFO)
         self.log.debug ("Started for IP: %s" % self.ip)
     # end def __init__
 
+    # The alarm is a process-wide signal and can only be used when the
+    # worker runs in the main thread of its own process. Other engines
+    # set use_alarm to False, the timeout is then enforced by the
+    # deadline of the session (and by the engine where possible).
+    # The deadline is also set with the alarm: The alarm only
+    # interrupts the main thread, the threads fetching pages in
+    # parallel stop at the deadline. The alarm only takes whole seconds.
+
+    def arm_alarm (self, timeout = None) :
+        if self.use_alarm :
+            self.armed = True
+            self.__super.arm_alarm (timeout = int (math.ceil (timeout)))
+    # end def arm_alarm
+
+    def disable_alarm (self) :
+        if self.armed :
+            self.armed = False
+            self.__super.disable_alarm ()
+    # end def disable_alarm
+
     def get_node_info (self) :
+        """ Return the `Guess` for our ip or a tuple of exception name
+            and exception if spidering failed.
+        """
+        start = time.time ()
+        self.session.deadline = start + self.timeout
         try :
-            if self.ip in self.result_dict :
-                return
             self.arm_alarm (timeout = self.timeout)
             try :
                 url  = ''
@@ -69,48 +198,55 @@ class Worker (Log, Timeout) :
                 port = None
                 if self.ip in self.ip_port :
                     port = self.ip_port [self.ip]
-                g    = Guess (site = site, ip = self.ip, url = '', port = port)
+                g    = Guess \
+                    ( site        = site
+                    , ip          = self.ip
+                    , url         = ''
+                    , port        = port
+                    , session     = self.session
+                    , fingerprint = self.fingerprint
+                    )
                 self.log.debug ("%s: after  guess" % self.ip)
             except ValueError as err :
                 self.disable_alarm ()
                 self.log.error ("Error in IP %s:" % self.ip)
                 self.log_exception ()
-                self.result_dict [self.ip] = ('ValueError', err)
-                return
+                return ('ValueError', err)
             except Timeout_Error as err :
                 self.disable_alarm ()
                 self.log.debug ("Timeout")
-                self.result_dict [self.ip] = ('Timeout_Error', err)
-                return
+                return ('Timeout_Error', err)
             except Exception as err :
                 self.disable_alarm ()
                 self.log.error ("Error in IP %s:" % self.ip)
                 self.log_exception ()
-                self.result_dict [self.ip] = ('Exception', err)
-                return
+                return ('Exception', err)
             self.disable_alarm ()
-            result = []
-#            for iface_ip in pyk.iterkeys (g.ips) :
-#                iface = iface_ip.iface
-#                r = [iface.name]
-#                if iface.is_wlan :
-#                    r.extend \
-#                        (( True
-#                        ,  iface.wlan_info.ssid
-#                        ,  iface.wlan_info.mode
-#                        ,  iface.wlan_info.channel
-#                        ,  iface.wlan_info.bssid
-#                        ))
-#                else :
-#                    r.append (False)
-#                result.append (r)
-            self.result_dict [self.ip] = g
+            return g
         except Exception as err :
             self.log.error ("Error in IP %s:" % self.ip)
             self.log_exception ()
-            self.result_dict [self.ip] = ("ERROR", err)
+            return ("ERROR", err)
+        finally :
+            self.disable_alarm ()
+            self.duration = time.time () - start
+            self.session.close ()
     # end def get_node_info
 
+    def info (self) :
+        """ Page cache entries, duration of the run and the longest
+            time to first byte of the node, passed back to the spider.
+        """
+        ttfb = None
+        if self.session.ttfb :
+            ttfb = max (self.session.ttfb)
+        return dict \
+            ( pages    = self.session.pages
+            , duration = self.duration
+            , ttfb     = ttfb
+            )
+    # end def info
+
 # end class Worker
 
 class Spider (Log) :
@@ -118,56 +254,643 @@ class Spider (Log) :
     def __init__ \
         ( self
         , olsr_file
-        , processes =    20
-        , N         =     0
-        , timeout   =   180
-        , ip_port   =    {}
-        , debug     = False
+        , processes    =    20
+        , N            =     0
+        , timeout      =   180
+        , ip_port      =    {}
+        , debug        = False
+        , per_link     =     0
+        , journal      =  None
+        , fingerprints =  None
+        , page_cache   =  None
+        , throttle     =  None
+        , min_gap      =     0
+        , presweep     =     0
+        , latency      =  None
+        , shard        =  None
+        , incremental  =  None
+        , previous     =  None
+        , negative     =  None
+        , breaker      =  None
+        , html_parser  = 'html.parser'
         , ** kw
         ) :
         self.__super.__init__ (**kw)
-        olsr = get_olsr_container (olsr_file)
-        self.olsr_nodes = {}
-        assert len (olsr.topo.forward)
-        for t in pyk.iterkeys (olsr.topo.forward) :
-            self.olsr_nodes [t] = True
-        for t in pyk.iterkeys (olsr.topo.reverse) :
-            self.olsr_nodes [t] = True
-        # limit to N elements
-        if N :
-            self.olsr_nodes = dict \
-                ((k, v) for k, v in islice (pyk.iteritems (self.olsr_nodes), N))
-        self.pool        = Pool (processes = processes)
-        self.mgr         = Manager ()
-        self.result_dict = self.mgr.dict ()
+        self.olsr_file   = olsr_file
+        self.shard       = shard
+        self.N           = N
+        self.claimed     = {}
+        self.load_nodes ()
+        self.processes   = processes
         self.timeout     = timeout
         self.ip_port     = ip_port
         self.debug       = debug
+        self.per_link    = per_link
+        self.journal     = journal
+        self.fingerprints = fingerprints
+        self.page_cache  = page_cache
+        self.throttle    = throttle
+        self.min_gap     = min_gap
+        self.presweep    = presweep
+        self.latency     = latency
+        self.incremental = incremental
+        self.negative    = negative
+        self.breaker     = breaker
+        self.html_parser = html_parser
+        self.result_dict = {}
+        self.sched       = None
+        if journal :
+            self.result_dict.update (journal.results)
+        if incremental and previous :
+            self.carry_forward (previous)
+        if negative :
+            self.reuse_failures ()
+        self.claim_preloaded ()
         olsr_nodes       = None
         if not debug :
             self.log.setLevel (INFO)
         self.log.debug ("Starting ...")
     # end def __init__
 
-    def process (self) :
-        for node in self.olsr_nodes :
-            self.pool.apply_async \
-                ( get_node_info
-                , ( self.result_dict
-                  , str (node)
-                  , self.timeout
-                  , self.ip_port
-                  , self.debug
-                  )
+    def load_nodes (self) :
+        """ Read the topology from `olsr_file`: The nodes to spider are
+            in `olsr_nodes` (the IPs as strings in `nodes`), the aliases
+            of the nodes by main address in `aliases`.
+        """
+        olsr       = get_olsr_container (self.olsr_file)
+        olsr_nodes = {}
+        assert len (olsr.topo.forward)
+        for t in pyk.iterkeys (olsr.topo.forward) :
+            olsr_nodes [t] = True
+        for t in pyk.iterkeys (olsr.topo.reverse) :
+            olsr_nodes [t] = True
+        # spider nodes with several addresses only via their main
+        # address, the aliases get the result of the main address
+        aliases = {}
+        mid     = get_aliases (olsr)
+        nodes   = set (str (t) for t in olsr_nodes)
+        for t in list (olsr_nodes) :
+            main = mid.get (str (t))
+            if main in nodes :
+                del olsr_nodes [t]
+                aliases.setdefault (main, set ()).add (str (t))
+        # only nodes of our shard, given as tuple of index and number
+        if self.shard :
+            i, n = self.shard
+            olsr_nodes = dict \
+                ( (k, v) for k, v in pyk.iteritems (olsr_nodes)
+                  if shard_index (k, n) == i
                 )
+        # limit to N elements
+        if self.N :
+            items      = islice (pyk.iteritems (olsr_nodes), self.N)
+            olsr_nodes = dict ((k, v) for k, v in items)
+        self.topology   = get_topology (olsr)
+        self.olsr_nodes = olsr_nodes
+        self.aliases    = aliases
+        self.nodes      = set (str (t) for t in olsr_nodes)
+    # end def load_nodes
+
+    def process (self) :
+        """ Tasks are handed to the workers by the scheduler, at most
+            `capacity` are in flight. Results are returned by the
+            workers and collected here as they arrive.
+        """
+        self.start ()
+        scheduler = self.scheduler ()
+        while True :
+            while scheduler.in_flight < self.capacity :
+                task = scheduler.next_task ()
+                if task is None :
+                    break
+                self.submit (task)
+            if not scheduler.in_flight :
+                if not len (scheduler) :
+                    break
+                # only tasks of paused links left
+                time.sleep (scheduler.wait ())
+                continue
+            ip, result, info = self.results.get ()
+            scheduler.done (ip)
+            self.collect (ip, result, info)
+        self.stop ()
+    # end def process
+
+    def start (self) :
+        """ Start the pool, one node per process is in flight """
+        self.capacity = self.processes
+        self.results  = Queue ()
+        self.pool     = Pool \
+            ( processes   = self.processes
+            , initializer = init_worker
+            , initargs    = (self.throttle,)
+            )
+    # end def start
+
+    def submit (self, task) :
+        ip, kw = task
+        args   = dict (callback = self.results.put)
+        if sys.version_info [0] > 2 :
+            # A task lost in the pool, e.g., when its result can't be
+            # sent back, must still produce an entry
+            args ['error_callback'] = lambda err : self.results.put \
+                ((ip, ("ERROR", repr (err)), None))
+        self.pool.apply_async (get_node_info_args, (task,), ** args)
+    # end def submit
+
+    def stop (self) :
         self.pool.close ()
         self.pool.join  ()
-        # broken dict proxy interface, make local dict with full interface
-        self.result_dict = dict (self.result_dict)
-    # end def process
+    # end def stop
+
+    def terminate (self) :
+        """ Stop the workers without waiting for the nodes in flight """
+        self.pool.terminate ()
+        self.pool.join      ()
+    # end def terminate
+
+    def carry_forward (self, previous) :
+        """ Reuse the results of the `previous` run for all nodes
+            that are unchanged according to the topology cache.
+            Failed nodes are spidered again.
+        """
+        n = 0
+        for node in self.olsr_nodes :
+            ip = str (node)
+            if ip in self.result_dict :
+                continue
+            result = previous.get (ip)
+            if not isinstance (result, Guess) :
+                continue
+            if self.incremental.unchanged (ip, self.topology.get (ip, ())) :
+                self.result_dict [ip] = result
+                n += 1
+        self.log.debug \
+            ( "Incremental: %s of %s nodes unchanged"
+            % (n, len (self.olsr_nodes))
+            )
+    # end def carry_forward
+
+    def reuse_failures (self) :
+        """ Reuse the last result of nodes that failed repeatedly and
+            are not due for another probe, see `Negative_Cache`.
+        """
+        n = 0
+        for node in self.olsr_nodes :
+            ip = str (node)
+            if ip in self.result_dict :
+                continue
+            result = self.negative.get (ip)
+            if result is not None :
+                self.result_dict [ip] = result
+                n += 1
+        self.log.debug ("Negative cache: %s nodes skipped" % n)
+    # end def reuse_failures
+
+    def claim_preloaded (self) :
+        """ Results from the journal or from earlier runs don't pass
+            through `collect`, claim the aliases of these nodes here.
+        """
+        for node in self.olsr_nodes :
+            ip = str (node)
+            if ip in self.result_dict :
+                self.claim_aliases (ip, self.result_dict [ip])
+    # end def claim_preloaded
+
+    def claim_aliases (self, ip, result) :
+        """ Record a `Guess` of ip for its aliases: Those from the
+            MID table and all its addresses that are still to be
+            spidered. The aliases reference the same result. If ip
+            failed, its aliases from the MID table are spidered instead.
+        """
+        if not isinstance (result, Guess) :
+            for a in self.aliases.pop (ip, ()) :
+                self.queue_alias (a)
+            return
+        aliases = set (self.aliases.get (ip, ()))
+        for i in result.ips :
+            a = str (getattr (i, 'ip', i)).split ('/') [0]
+            if a not in self.nodes :
+                continue
+            if a not in self.result_dict or self.claimed.get (a) == ip :
+                aliases.add (a)
+        aliases.discard (ip)
+        for a in aliases :
+            self.claimed [a] = ip
+            self.store (a, result)
+            if self.sched is not None :
+                self.sched.discard (a)
+    # end def claim_aliases
+
+    def queue_alias (self, ip) :
+        """ Spider alias ip of a node whose main address failed """
+        self.claimed.pop (ip, None)
+        self.nodes.add (ip)
+        if self.sched is not None and ip not in self.result_dict :
+            self.sched.add (ip, (ip, self.task (ip)))
+    # end def queue_alias
+
+    def collect (self, ip, result, info = None) :
+        """ Record result of ip, `info` is the info of the worker """
+        if ip in self.claimed :
+            # already claimed by the result of another address
+            return
+        self.store (ip, result)
+        if self.page_cache and info and info ['pages'] is not None :
+            self.page_cache.update (ip, info ['pages'])
+        if self.fingerprints and isinstance (result, Guess) :
+            self.fingerprints.update (self.fingerprint_key (ip), result)
+        if self.incremental and isinstance (result, Guess) :
+            self.incremental.update (ip, self.topology.get (ip, ()))
+        if self.negative and not self.unreachable (result) :
+            self.negative.update (ip, result)
+        if self.latency :
+            if isinstance (result, Guess) and info :
+                self.latency.update (ip, info ['duration'], info ['ttfb'])
+            elif isinstance (result, tuple) and result [0] == 'Timeout_Error' :
+                self.latency.timed_out (ip)
+        self.claim_aliases (ip, result)
+        sched = self.sched
+        if self.breaker and sched is not None and ip in sched.started :
+            self.check_link (ip, result)
+    # end def collect
+
+    def store (self, ip, result) :
+        """ Record result of ip in `result_dict` and the journal """
+        self.result_dict [ip] = result
+        if self.journal :
+            self.journal.append (ip, result)
+    # end def store
+
+    def check_link (self, ip, result) :
+        """ Feed result of ip into the circuit breaker of its link, if
+            the link is down the nodes behind it that are still queued
+            are recorded as 'Unreachable'.
+        """
+        link   = self.sched.link [ip]
+        failed = isinstance (result, tuple) and \
+            ( result [0] == 'Timeout_Error'
+            or isinstance (result [1], ConnectionError)
+            )
+        action = self.breaker.record (link, failed, self.sched.started [ip])
+        if action == 'pause' :
+            self.log.debug ("Link via %s failing, pausing" % link)
+            self.sched.pause (link, time.time () + self.breaker.window)
+        elif action == 'resume' :
+            self.sched.resume (link)
+        elif action == 'down' :
+            self.log.debug ("Link via %s is down" % link)
+            self.sched.resume (link)
+            for a in self.sched.queued (link) :
+                self.sched.discard (a)
+                err = Timeout_Error ("Link via %s is down" % link)
+                self.collect (a, ('Unreachable', err))
+    # end def check_link
+
+    @staticmethod
+    def unreachable (result) :
+        return isinstance (result, tuple) and result [0] == 'Unreachable'
+    # end def unreachable
+
+    def fingerprint_key (self, ip) :
+        return '%s:%s' % (ip, self.port (ip))
+    # end def fingerprint_key
+
+    def port (self, ip) :
+        return int (self.ip_port.get (ip) or 80)
+    # end def port
+
+    def scheduler (self) :
+        """ Return scheduler with all tasks. With `presweep` all
+            nodes are probed with a TCP connect first, nodes not
+            answering within `presweep` seconds are recorded as
+            timeout without using a worker.
+        """
+        scheduler = self.sched = Scheduler (self.topology, self.per_link)
+        tasks     = list (self.tasks ())
+        alive     = None
+        if self.presweep :
+            alive = presweep \
+                ( ((ip, self.port (ip)) for ip, kw in tasks)
+                , timeout = self.presweep
+                )
+            self.log.debug \
+                ( "Presweep: %s of %s nodes reachable"
+                % (len (alive), len (tasks))
+                )
+        for ip, kw in tasks :
+            if alive is not None and (ip, self.port (ip)) not in alive :
+                err = Timeout_Error ("Presweep: no connect to %s" % ip)
+                self.collect (ip, ('Timeout_Error', err))
+                continue
+            scheduler.add (ip, (ip, kw))
+        return scheduler
+    # end def scheduler
+
+    def task (self, ip) :
+        """ Keyword arguments of the worker for ip """
+        timeout = self.timeout
+        if self.latency :
+            timeout = self.latency.timeout (ip, self.timeout)
+        kw = dict \
+            ( timeout = timeout
+            , ip_port = self.ip_port
+            , debug   = self.debug
+            , min_gap = self.min_gap
+            , parser  = self.html_parser
+            )
+        if self.fingerprints :
+            kw ['fingerprint'] = self.fingerprints.get \
+                (self.fingerprint_key (ip))
+        if self.page_cache :
+            kw ['pages'] = self.page_cache.get (ip)
+        return kw
+    # end def task
+
+    def tasks (self) :
+        """ Tasks of all nodes without a result, including the queued
+            aliases of failed nodes.
+        """
+        for ip in self.nodes :
+            if ip in self.result_dict :
+                continue
+            yield ip, self.task (ip)
+    # end def tasks
 
 # end def Spider
 
+class Thread_Spider (Spider) :
+    """ Each of the `processes` worker processes spiders `threads`
+        nodes in parallel, each in its own thread. Since signals can't
+        interrupt a single thread, the timeout of a node is enforced
+        cooperatively by the deadline of its session: No request is
+        started after the deadline and the timeouts of requests are
+        shortened to end at the deadline.
+    """
+
+    def __init__ (self, * args, ** kw) :
+        self.threads = kw.pop ('threads', 10)
+        self.__super.__init__ (* args, ** kw)
+    # end def __init__
+
+    def start (self) :
+        self.capacity   = self.processes * self.threads
+        self.task_queue = Process_Queue ()
+        self.results    = Process_Queue ()
+        self.workers    = []
+        args            = \
+            (self.task_queue, self.results, self.throttle, self.threads)
+        for n in range (self.processes) :
+            p = Process (target = thread_worker, args = args)
+            p.daemon = True
+            p.start ()
+            self.workers.append (p)
+    # end def start
+
+    def submit (self, task) :
+        self.task_queue.put (task)
+    # end def submit
+
+    def stop (self) :
+        for n in range (self.capacity) :
+            self.task_queue.put (None)
+        for p in self.workers :
+            p.join ()
+    # end def stop
+
+    def terminate (self) :
+        for p in self.workers :
+            p.terminate ()
+        for p in self.workers :
+            p.join ()
+    # end def terminate
+
+# end class Thread_Spider
+
+class Shard_Queue (autosuper) :
+    """ Task queues of the hybrid engine, one shard per process. Tasks
+        are taken from our own shard, when it is empty a task is stolen
+        from the other shards. When no shard has a task, we wait for
+        our own shard for `poll` seconds at a time until `finished` is
+        set.
+    """
+
+    def __init__ (self, index, shards, finished, poll = 0.1) :
+        self.index    = index
+        self.shards   = shards
+        self.finished = finished.is_set
+        self.poll     = poll
+    # end def __init__
+
+    def get (self) :
+        """ Return next task or None when finished """
+        while True :
+            task = self.next_task ()
+            if task is not None or self.finished () :
+                return task
+            try :
+                return self.shards [self.index].get (timeout = self.poll)
+            except Empty :
+                pass
+    # end def get
+
+    def next_task (self) :
+        n = len (self.shards)
+        for i in range (n) :
+            try :
+                return self.shards [(self.index + i) % n].get_nowait ()
+            except Empty :
+                pass
+        return None
+    # end def next_task
+
+# end class Shard_Queue
+
+class Hybrid_Spider (Thread_Spider) :
+    """ Like `Thread_Spider` each of the `processes` worker processes
+        spiders `threads` nodes in parallel, so that parsing uses all
+        cores while many slow requests are waited for. But instead of a
+        single task queue, the scheduler hands each task to the shard
+        of the node, a process that runs out of work steals tasks from
+        the other shards. All processes send their results back to us
+        via a single queue.
+    """
+
+    def start (self) :
+        self.capacity = self.processes * self.threads
+        self.shards   = [Process_Queue () for n in range (self.processes)]
+        self.results  = Process_Queue ()
+        self.finished = Event ()
+        self.workers  = []
+        for n in range (self.processes) :
+            args = \
+                ( n, self.shards, self.results, self.finished
+                , self.throttle, self.threads
+                )
+            p = Process (target = shard_worker, args = args)
+            p.daemon = True
+            p.start ()
+            self.workers.append (p)
+    # end def start
+
+    def submit (self, task) :
+        ip, kw = task
+        self.shards [shard_index (ip, self.processes)].put (task)
+    # end def submit
+
+    def stop (self) :
+        self.finished.set ()
+        for p in self.workers :
+            p.join ()
+    # end def stop
+
+# end class Hybrid_Spider
+
+engines = dict (pool = Spider, hybrid = Hybrid_Spider)
+
+class Daemon_Mixin (autosuper) :
+    """ Spider continuously: Each node is visited again when it is due
+        according to the `revisit` queue, see `Revisit_Queue`. The
+        current results are kept in `result_dict` (preloaded from an
+        existing `dump`), a failed visit doesn't replace the last good
+        result of a node. The results are written to `dump` every
+        `checkpoint` seconds together with the caches, the journal is
+        started anew after each checkpoint. At each checkpoint the
+        `olsr_file` is read again: Nodes that joined the network are
+        visited right away, nodes that left are no longer visited.
+        The daemon runs until interrupted, the nodes in flight are
+        then dropped. Combined with a spider that implements `start`,
+        `submit` and `terminate`, the per-link limit and the presweep
+        are not used.
+    """
+
+    def __init__ (self, * args, ** kw) :
+        self.revisit    = kw.pop ('revisit')
+        self.dump       = kw.pop ('dump')
+        self.interval   = kw.pop ('checkpoint', 600)
+        self.__super.__init__ (* args, ** kw)
+        if os.path.exists (self.dump) :
+            results = load_dump (self.dump)
+            results.update (self.result_dict)
+            self.result_dict = results
+    # end def __init__
+
+    def process (self) :
+        self.start ()
+        now = time.time ()
+        for node in self.olsr_nodes :
+            self.revisit.add (str (node), now)
+        in_flight  = 0
+        checkpoint = now + self.interval
+        try :
+            while True :
+                now = time.time ()
+                while in_flight < self.capacity :
+                    ip = self.revisit.pop_due (now)
+                    if ip is None :
+                        break
+                    if ip in self.claimed or ip not in self.nodes :
+                        continue
+                    self.submit ((ip, self.task (ip)))
+                    in_flight += 1
+                if now >= checkpoint :
+                    self.update_nodes (now)
+                    self.checkpoint ()
+                    checkpoint = now + self.interval
+                wait = checkpoint - now
+                due  = self.revisit.next_due ()
+                if due is not None and in_flight < self.capacity :
+                    wait = min (wait, due - now)
+                wait = max (wait, 0)
+                if not in_flight :
+                    time.sleep (wait)
+                    continue
+                try :
+                    ip, result, info = self.results.get (timeout = wait)
+                except Empty :
+                    continue
+                in_flight -= 1
+                self.collect (ip, result, info)
+        except KeyboardInterrupt :
+            self.log.info ("Interrupted, writing checkpoint")
+        finally :
+            self.terminate ()
+        self.checkpoint ()
+    # end def process
+
+    def collect (self, ip, result, info = None) :
+        changed = None
+        if isinstance (result, Guess) :
+            changed = result != self.result_dict.get (ip)
+        self.revisit.visited (ip, changed)
+        self.__super.collect (ip, result, info)
+    # end def collect
+
+    def store (self, ip, result) :
+        """ A failure is only recorded if we have no good result """
+        if isinstance (self.result_dict.get (ip), Guess) :
+            if not isinstance (result, Guess) :
+                return
+        self.__super.store (ip, result)
+    # end def store
+
+    def queue_alias (self, ip) :
+        self.__super.queue_alias (ip)
+        self.revisit.add (ip)
+    # end def queue_alias
+
+    def update_nodes (self, now) :
+        """ Read the topology again, new nodes are due `now` """
+        old = self.nodes
+        try :
+            self.load_nodes ()
+        except Exception :
+            self.log.error ("Error reading %s:" % self.olsr_file)
+            self.log_exception ()
+            return
+        new = self.nodes - old
+        for ip in new :
+            self.revisit.add (ip, now)
+        self.log.debug \
+            ( "Topology: %s new, %s gone"
+            % (len (new), len (old - self.nodes))
+            )
+    # end def update_nodes
+
+    def checkpoint (self) :
+        save_state (self.dump, self.result_dict)
+        self.journal.close (remove = True)
+        self.journal = Journal (self.journal.filename)
+        for cache in \
+            ( self.fingerprints, self.page_cache, self.latency
+            , self.incremental, self.negative
+            ) :
+            if cache :
+                cache.save ()
+        self.revisit.save ()
+        self.log.debug ("Checkpoint: %s nodes" % len (self.result_dict))
+    # end def checkpoint
+
+# end class Daemon_Mixin
+
+class Daemon_Spider (Daemon_Mixin, Spider) :
+    pass
+# end class Daemon_Spider
+
+class Daemon_Thread_Spider (Daemon_Mixin, Thread_Spider) :
+    pass
+# end class Daemon_Thread_Spider
+
+class Daemon_Hybrid_Spider (Daemon_Mixin, Hybrid_Spider) :
+    pass
+# end class Daemon_Hybrid_Spider
+
+daemons = \
+    { Spider        : Daemon_Spider
+    , Thread_Spider : Daemon_Thread_Spider
+    , Hybrid_Spider : Daemon_Hybrid_Spider
+    }
+
 
 def main () :
     cmd = ArgumentParser ()
@@ -178,12 +901,89 @@ def main () :
         , action  = "store_true"
         , default = False
         )
+    cmd.add_argument \
+        ( "-b", "--bandwidth"
+        , dest    = "bandwidth"
+        , help    = "Limit bandwidth of all requests to given number of "
+                    "bytes per second"
+        , type    = int
+        )
+    cmd.add_argument \
+        ( "--breaker"
+        , dest    = "breaker"
+        , help    = "Pause a radio link when given number of nodes behind "
+                    "it time out within --breaker-window seconds, mark "
+                    "the remaining nodes as unreachable if it still fails"
+        , type    = int
+        , default = 0
+        )
+    cmd.add_argument \
+        ( "--breaker-window"
+        , dest    = "breaker_window"
+        , help    = "Time window and pause in seconds for --breaker, "
+                    "default: %(default)s"
+        , type    = float
+        , default = 60
+        )
+    cmd.add_argument \
+        ( "--checkpoint-interval"
+        , dest    = "checkpoint_interval"
+        , help    = "Time in seconds between two checkpoints of --daemon, "
+                    "default: %(default)s"
+        , type    = float
+        , default = 600
+        )
+    cmd.add_argument \
+        ( "--daemon"
+        , dest    = "daemon"
+        , help    = "Run continuously, visit nodes again depending on how "
+                    "often they changed and failed"
+        , action  = "store_true"
+        , default = False
+        )
     cmd.add_argument \
         ( "-d", "--dump"
         , dest    = "dump"
         , help    = "Destination file of pickle dump, default: %(default)s"
         , default = "Funkfeuer-spider-pickle.dump"
         )
+    cmd.add_argument \
+        ( "-e", "--engine"
+        , dest    = "engine"
+        , help    = "Spider engine, one of %s, default: %%(default)s"
+                  % ', '.join (sorted (engines))
+        , choices = sorted (engines)
+        , default = "pool"
+        )
+    cmd.add_argument \
+        ( "-f", "--fingerprint-cache"
+        , dest    = "fingerprint_cache"
+        , help    = "Cache file for detected web frontend of nodes, "
+                    "saves probing of the frontend on later runs"
+        )
+    cmd.add_argument \
+        ( "--fingerprint-ttl"
+        , dest    = "fingerprint_ttl"
+        , help    = "Time in seconds after which a cached web frontend "
+                    "is detected again, default: %(default)s"
+        , type    = int
+        , default = 7 * 86400
+        )
+    cmd.add_argument \
+        ( "--incremental"
+        , dest    = "incremental"
+        , help    = "File with the neighbours of each node when it was "
+                    "last spidered; unchanged nodes are not spidered, "
+                    "their result is taken from the previous dump"
+        )
+    cmd.add_argument \
+        ( "--html-parser"
+        , dest    = "html_parser"
+        , help    = "HTML parser for pages, one of %(choices)s, "
+                    "default: %(default)s"
+        , choices = ('html.parser', 'lxml')
+        , default = 'html.parser'
+        )
     cmd.add_argument \
         ( "-i", "--ip-port"
         , dest    = "ip_port"
@@ -191,6 +991,26 @@ def main () :
         , help    = "IP-Addres:Port combination with non-standard port"
         , default = []
         )
+    cmd.add_argument \
+        ( "-j", "--journal"
+        , dest    = "journal"
+        , help    = "Journal file where each result is logged as soon as "
+                    "it is known, default: dump file name with .journal"
+        )
+    cmd.add_argument \
+        ( "--latency-history"
+        , dest    = "latency_history"
+        , help    = "File with the latency of nodes in earlier runs, "
+                    "used for a per-node timeout of at most --timeout"
+        )
+    cmd.add_argument \
+        ( "--max-age"
+        , dest    = "max_age"
+        , help    = "Maximum age in seconds of a result reused by "
+                    "--incremental, default: %(default)s"
+        , type    = float
+        , default = 86400
+        )
     cmd.add_argument \
         ( "-n", "--limit-devices"
         , dest    = "limit_devices"
@@ -198,6 +1018,20 @@ def main () :
         , type    = int
         , default = 0
         )
+    cmd.add_argument \
+        ( "--page-cache"
+        , dest    = "page_cache"
+        , help    = "Cache file for pages, unchanged pages of a node are "
+                    "not parsed again"
+        )
+    cmd.add_argument \
+        ( "-P", "--per-link"
+        , dest    = "per_link"
+        , help    = "Maximum number of nodes spidered in parallel over "
+                    "the same radio link, default: %(default)s (no limit)"
+        , type    = int
+        , default = 0
+        )
     cmd.add_argument \
         ( "-p", "--processes"
         , dest    = "processes"
@@ -205,6 +1039,29 @@ def main () :
         , type    = int
         , default = 20
         )
+    cmd.add_argument \
+        ( "-g", "--node-gap"
+        , dest    = "node_gap"
+        , help    = "Minimum time in seconds between two requests to the "
+                    "same node, default: %(default)s"
+        , type    = float
+        , default = 0
+        )
+    cmd.add_argument \
+        ( "--negative-cache"
+        , dest    = "negative_cache"
+        , help    = "Cache file for failing nodes, a node failing "
+                    "repeatedly is probed on exponentially increasing "
+                    "intervals, its last result is reused in between"
+        )
+    cmd.add_argument \
+        ( "--negative-interval"
+        , dest    = "negative_interval"
+        , help    = "Time in seconds until a failed node is probed again "
+                    "after its first failure, default: %(default)s"
+        , type    = float
+        , default = 3600
+        )
     cmd.add_argument \
         ( "-o", "--olsr-file"
         , dest    = "olsr_file"
@@ -212,6 +1069,59 @@ def main () :
                     "default: %(default)s"
         , default = "olsr/txtinfo.txt"
         )
+    cmd.add_argument \
+        ( "-r", "--resume"
+        , dest    = "resume"
+        , help    = "Resume an interrupted run from its journal, nodes "
+                    "already in the journal are not spidered again"
+        , action  = "store_true"
+        , default = False
+        )
+    cmd.add_argument \
+        ( "--presweep"
+        , dest    = "presweep"
+        , help    = "Probe all nodes with a TCP connect before spidering, "
+                    "record nodes not answering as timeout"
+        , action  = "store_true"
+        , default = False
+        )
+    cmd.add_argument \
+        ( "--presweep-timeout"
+        , dest    = "presweep_timeout"
+        , help    = "Timeout in seconds for TCP connect of --presweep, "
+                    "default: %(default)s"
+        , type    = float
+        , default = 3
+        )
+    cmd.add_argument \
+        ( "-q", "--requests-per-second"
+        , dest    = "requests_per_second"
+        , help    = "Limit number of requests per second of all workers"
+        , type    = float
+        )
+    cmd.add_argument \
+        ( "--threads"
+        , dest    = "threads"
+        , help    = "Spider given number of nodes in parallel in threads "
+                    "of each process (pool and hybrid engine, default for "
+                    "hybrid engine: 10)"
+        , type    = int
+        , default = 0
+        )
+    cmd.add_argument \
+        ( "--revisit-interval"
+        , dest    = "revisit_interval"
+        , help    = "Base interval in seconds between two visits of a node "
+                    "with --daemon, default: %(default)s"
+        , type    = float
+        , default = 3600
+        )
+    cmd.add_argument \
+        ( "--shard"
+        , dest    = "shard"
+        , help    = "Spider only part i of N parts of the network, given "
+                    "as i/N with i from 1 to N, e.g., 1/4"
+        )
     cmd.add_argument \
         ( "-t", "--timeout"
         , dest    = "timeout"
@@ -226,22 +1136,82 @@ def main () :
         , action  = "count"
         )
     opt = cmd.parse_args ()
-    sp = Spider \
+    kw  = {}
+    engine = engines [opt.engine]
+    if opt.engine == 'hybrid' :
+        kw ['threads'] = opt.threads or 10
+    elif opt.threads :
+        engine         = Thread_Spider
+        kw ['threads'] = opt.threads
+    journal = opt.journal
+    if not journal :
+        journal = opt.dump + '.journal'
+        if opt.dump.endswith ('.gz') :
+            journal = opt.dump [:-3] + '.journal.gz'
+    kw ['journal'] = Journal (journal, resume = opt.resume)
+    if opt.fingerprint_cache :
+        kw ['fingerprints'] = Fingerprint_Cache \
+            (opt.fingerprint_cache, opt.fingerprint_ttl)
+    if opt.page_cache :
+        kw ['page_cache'] = Page_Cache (opt.page_cache)
+    if opt.latency_history :
+        kw ['latency'] = Latency_History (opt.latency_history)
+    if opt.breaker :
+        kw ['breaker'] = Circuit_Breaker (opt.breaker, opt.breaker_window)
+    if opt.negative_cache :
+        kw ['negative'] = Negative_Cache \
+            (opt.negative_cache, opt.negative_interval)
+    if opt.incremental :
+        kw ['incremental'] = Topology_Cache (opt.incremental, opt.max_age)
+        if os.path.exists (opt.dump) :
+            kw ['previous'] = load_dump (opt.dump)
+    if opt.bandwidth or opt.requests_per_second :
+        kw ['throttle'] = Throttle (opt.requests_per_second, opt.bandwidth)
+    if opt.daemon :
+        engine            = daemons [engine]
+        kw ['dump']       = opt.dump
+        kw ['revisit']    = Revisit_Queue \
+            (opt.dump + '.revisit', opt.revisit_interval)
+        kw ['checkpoint'] = opt.checkpoint_interval
+    if opt.shard :
+        try :
+            i, n = (int (x) for x in opt.shard.split ('/'))
+        except ValueError :
+            cmd.error ("Invalid --shard: %s" % opt.shard)
+        if not 1 <= i <= n :
+            cmd.error ("Invalid --shard: %s" % opt.shard)
+        kw ['shard'] = (i - 1, n)
+    kw ['min_gap']     = opt.node_gap
+    kw ['html_parser'] = opt.html_parser
+    kw ['per_link']    = opt.per_link
+    if opt.presweep :
+        kw ['presweep'] = opt.presweep_timeout
+    sp = engine \
         ( opt.olsr_file
         , opt.processes
         , opt.limit_devices
         , opt.timeout
         , dict (x.split (':', 1) for x in opt.ip_port)
         , opt.debug
+        , ** kw
         )
     try :
         sp.process ()
-        if opt.dump.endswith ('.gz') :
-            f = GzipFile (opt.dump, "wb", 9)
-        else :
-            f = open (opt.dump, "wb")
+        f = open_dump (opt.dump, "wb")
         pickle.dump (sp.result_dict, f)
         f.close ()
+        # All results are in the dump now
+        sp.journal.close (remove = True)
+        if sp.fingerprints :
+            sp.fingerprints.save ()
+        if sp.page_cache :
+            sp.page_cache.save ()
+        if sp.latency :
+            sp.latency.save ()
+        if sp.incremental :
+            sp.incremental.save ()
+        if sp.negative :
+            sp.negative.save ()
         if opt.verbose :
             for k, v in sorted \
                 ( pyk.iteritems (sp.result_dict)
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# #*** <License> ************************************************************#
+# This module is part of the repository CNDB.
+#
+# This module is licensed under the terms of the BSD 3-Clause License
+# <http://www.c-tanzer.at/license/bsd_3c.html>.
+# #*** </License> ***********************************************************#
+
+import time
+from   multiprocessing    import Lock, RawValue
+from   rsclib.autosuper   import autosuper
+
+class Token_Bucket (autosuper) :
+    """ Token bucket filled with `rate` tokens per second up to `burst`
+        tokens (default one second worth but at least one token). The
+        state is in shared memory, so a bucket created before starting
+        the worker processes is shared by all of them (and by all
+        threads).
+    """
+
+    def __init__ (self, rate, burst = None) :
+        self.rate   = float (rate)
+        self.burst  = float (burst or max (rate, 1))
+        self.lock   = Lock ()
+        self.tokens = RawValue ('d', self.burst)
+        self.stamp  = RawValue ('d', time.time ())
+    # end def __init__
+
+    def acquire (self, n = 1) :
+        """ Wait until n tokens are available and take them """
+        while True :
+            with self.lock :
+                self._refill ()
+                if self.tokens.value >= n :
+                    self.tokens.value -= n
+                    return
+                wait = (n - self.tokens.value) / self.rate
+            time.sleep (wait)
+    # end def acquire
+
+    def charge (self, n) :
+        """ Take n tokens without waiting, this may leave the bucket in
+            debt so that later calls to `acquire` have to wait.
+        """
+        with self.lock :
+            self._refill ()
+            self.tokens.value -= n
+    # end def charge
+
+    def _refill (self) :
+        now  = time.time ()
+        fill = (now - self.stamp.value) * self.rate
+        self.tokens.value = min (self.burst, self.tokens.value + fill)
+        self.stamp.value  = now
+    # end def _refill
+
+# end class Token_Bucket
+
+class Throttle (autosuper) :
+    """ Limit the requests per second and the bandwidth in bytes per
+        second used by all workers of a spider run. The size of a
+        response is only known after it has been received, it is
+        charged afterwards and delays the following requests.
+    """
+
+    def __init__ (self, requests = None, bandwidth = None) :
+        self.requests  = None
+        self.bandwidth = None
+        if requests :
+            self.requests  = Token_Bucket (requests)
+        if bandwidth :
+            self.bandwidth = Token_Bucket (bandwidth)
+    # end def __init__
+
+    def before_request (self) :
+        if self.bandwidth :
+            self.bandwidth.acquire (0)
+        if self.requests :
+            self.requests.acquire (1)
+    # end def before_request
+
+    def after_request (self, nbytes) :
+        if self.bandwidth :
+            self.bandwidth.charge (nbytes)
+    # end def after_request
+
+# end class Throttle
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+# #*** <License> ************************************************************#
+# This module is part of the repository CNDB.
+#
+# This module is licensed under the terms of the BSD 3-Clause License
+# <http://www.c-tanzer.at/license/bsd_3c.html>.
+# #*** </License> ***********************************************************#
+
+import os
+import unittest
+
+try :
+    import lxml
+except ImportError :
+    lxml = None
+
+from ff_spider.common      import Session, Soup_Client
+from ff_spider.parser      import Guess, First_Guess, Ambiguous_Page
+
+pages = os.path.join (os.path.dirname (__file__), 'pages')
+
+# Saved pages of each backend by path on the node
+samples = dict \
+    ( Freifunk  =
+        ( '193.238.158.1'
+        , { ''                                     : 'index.html'
+          , 'cgi-bin-status.html'                  : 'cgi-bin-status.html'
+          }
+        )
+    , Backfire  =
+        ( '193.238.164.1'
+        , { ''                                     : 'index.html'
+          , 'cgi-bin/luci'                         : 'luci.html'
+          , 'cgi-bin/luci/freifunk/olsr/interfaces': 'interfaces.html'
+          , 'cgi-bin/luci/freifunk/status'         : 'status.html'
+          }
+        )
+    , OpenWRT   =
+        ( '193.238.167.1'
+        , { ''                                     : 'index.html'
+          , 'cgi-bin/luci'                         : 'luci.html'
+          , 'cgi-bin/luci/freifunk/status/status'  : 'status.html'
+          , 'cgi-bin/luci/freifunk/olsr/'          : 'olsr.html'
+          , 'cgi-bin/luci/freifunk/olsr/routes'    : 'routes.html'
+          }
+        )
+    , Router_OS =
+        ( '193.238.170.1'
+        , { ''                                     : 'index.html'
+          , 'cgi-bin/index.cgi?post_routes=2'      : 'routes.html'
+          , 'cgi-bin/index.cgi?post_olsr=1'        : 'details.html'
+          }
+        )
+    , OLSR      =
+        ( '193.238.156.10'
+        , { ''                                     : 'index.html'
+          }
+        )
+    )
+
+class Response (object) :
+
+    def __init__ (self, content, status_code = 200, reason = 'OK') :
+        self.content     = content
+        self.status_code = status_code
+        self.reason      = reason
+        self.ok          = status_code < 400
+        self.headers     = {}
+    # end def __init__
+
+# end class Response
+
+class Page_Transport (object) :
+    """ Answer requests with the saved pages of a node """
+
+    def __init__ (self, site, backend, by_path) :
+        self.site    = site
+        self.dir     = os.path.join (pages, backend.lower ())
+        self.by_path = by_path
+    # end def __init__
+
+    def get (self, url, ** kw) :
+        assert url.startswith (self.site + '/'), url
+        path = url [len (self.site) + 1:]
+        if path not in self.by_path :
+            return Response (b'', 404, 'Not Found')
+        f = open (os.path.join (self.dir, self.by_path [path]), 'rb')
+        content = f.read ()
+        f.close ()
+        return Response (content)
+    # end def get
+
+    def close (self) :
+        pass
+    # end def close
+
+# end class Page_Transport
+
+class Byte_Guess (First_Guess) :
+    """ Keep the page for `byte_guess` instead of parsing it """
+
+    def parse_content (self, content) :
+        self.content = content
+    # end def parse_content
+
+# end class Byte_Guess
+
+class Soup_Guess (First_Guess) :
+    """ Always parse the page with the trials of `parse` """
+
+    def fingerprint (self, content) :
+        return False
+    # end def fingerprint
+
+# end class Soup_Guess
+
+class Test_Parser_Parity (unittest.TestCase) :
+    """ All HTML parsers get the same information from the pages """
+
+    def setUp (self) :
+        self.parsed = []
+        _parse      = Soup_Client._parse
+        def parse (client, content, parser) :
+            self.parsed.append ((client.url, parser))
+            return _parse (client, content, parser)
+        Soup_Client._parse = parse
+        self.addCleanup (setattr, Soup_Client, '_parse', _parse)
+    # end def setUp
+
+    def guess (self, backend, parser) :
+        ip, by_path = samples [backend]
+        site        = 'http://%s' % ip
+        transport   = Page_Transport (site, backend, by_path)
+        session     = Session (transport = transport, parser = parser)
+        del self.parsed [:]
+        g = Guess (site, ip, session = session)
+        self.assertEqual (g.type, backend)
+        self.assertTrue (g.ips)
+        self.assertTrue (g.interfaces)
+        self.assertNotEqual (g.version, 'Unknown')
+        # no page fell back to another parser
+        for url, p in self.parsed :
+            self.assertEqual (p, parser, url)
+        return \
+            ( sorted (str (i) for i in g.ips)
+            , sorted ((k, str (v)) for k, v in g.interfaces.items ())
+            , g.version
+            )
+    # end def guess
+
+    @unittest.skipIf (lxml is None, "lxml is not installed")
+    def test_parity (self) :
+        for backend in sorted (samples) :
+            self.assertEqual \
+                ( self.guess (backend, 'html.parser')
+                , self.guess (backend, 'lxml')
+                , backend
+                )
+    # end def test_parity
+
+# end class Test_Parser_Parity
+
+class Test_Byte_Guess (unittest.TestCase) :
+    """ Deciding the web frontend from the raw bytes of a page comes
+        to the same conclusion as the soup or gives up.
+    """
+
+    site = 'http://10.0.0.1'
+
+    freifunk = \
+        ( b'<html><head><title>Freifunk</title></head><body>'
+          b'<big class="plugin">Freifunk</big>%s</body></html>'
+        )
+    router_os = \
+        ( b'<html><body><table>'
+          b'<tr><td>Uptime:</td><td>1 day</td></tr>'
+          b'<tr><td>Loadavg:</td><td>0.1</td></tr>'
+          b'<tr><td>Idle Time:</td><td>99%%</td></tr>'
+          b'%s</table></body></html>'
+        )
+    edge_cases = \
+        ( freifunk % b'<a class="plugin" href="s">Sta<!-- -->tus</a>'
+        , freifunk % b'<a class="plugin" href="s">Status<!-- --></a>'
+        , freifunk % b'<a class="plugin" href="s"><b>Status</b></a>'
+        , freifunk % b'<a class="plugin" href="s">Status&#32;klassisch</a>'
+        , freifunk % b'<a class="plugin" href="s&amp;t">Status</a>'
+        , freifunk % b'<!-- <a class="plugin" href="s">Status</a> -->'
+        , freifunk % b'<script>x = \'<a class="plugin" href="s">\'</script>'
+        , freifunk % b'<a class="plugin" href="s">Sta<script></script>tus</a>'
+        , router_os % b'<tr><td>Default<!-- --> Route:</td></tr>'
+        , router_os % b'<tr><td><b>Default Route:</b></td></tr>'
+        , router_os % b'<tr><td>Default&#32;Route:</td></tr>'
+        , router_os % b'<!-- <tr><td>Default Route:</td></tr> -->'
+        , b'<html><head><title>olsr.org <!-- -->httpinfo plugin</title>'
+          b'</head><body></body></html>'
+        , b'<html><head><title>olsr.org httpinfo plugin</title>'
+          b'</head><body></body></html>'
+        , b'<html><head><title><b>olsr.org httpinfo plugin</b></title>'
+          b'</head><body></body></html>'
+        , b'<html><head><!-- <meta http-equiv="refresh" '
+          b'content="0; URL=/cgi-bin/luci"> --></head></html>'
+        , b'<html><head><meta http-equiv="refresh" '
+          b'content="0; URL=/cgi-bin/luci"></head></html>'
+        )
+
+    def session (self, content) :
+        transport = Page_Transport (self.site, 'olsr', {'' : 'index.html'})
+        transport.get = lambda url, ** kw : Response (content)
+        return Session (transport = transport)
+    # end def session
+
+    def soup_guess (self, content) :
+        """ Backend and params found by the trials of `parse` """
+        rqinfo = Guess.new_rqinfo ('10.0.0.1')
+        try :
+            g = Soup_Guess \
+                (rqinfo, self.site, '', session = self.session (content))
+        except ValueError :
+            return None
+        return g.backend, g.params
+    # end def soup_guess
+
+    def byte_guess (self, content) :
+        """ Backend and params from the raw bytes, False if ambiguous """
+        rqinfo = Guess.new_rqinfo ('10.0.0.1')
+        g      = Byte_Guess \
+            (rqinfo, self.site, '', session = self.session (content))
+        try :
+            guess = g.byte_guess (g.byte_tags (g.content))
+        except Ambiguous_Page :
+            return False
+        if guess is None :
+            return None
+        backend, update = guess
+        g.params.update (update)
+        return backend, g.params
+    # end def byte_guess
+
+    def test_samples (self) :
+        for backend in sorted (samples) :
+            f = open (os.path.join (pages, backend.lower (), 'index.html'))
+            content = f.read ().encode ('utf-8')
+            f.close ()
+            guess = self.byte_guess (content)
+            self.assertTrue (guess, backend)
+            self.assertEqual (guess, self.soup_guess (content), backend)
+    # end def test_samples
+
+    def test_edge_cases (self) :
+        for content in self.edge_cases :
+            guess = self.byte_guess (content)
+            if guess is not False :
+                self.assertEqual (guess, self.soup_guess (content), content)
+    # end def test_edge_cases
+
+# end class Test_Byte_Guess
+
+if __name__ == '__main__' :
+    unittest.main ()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# #*** <License> ************************************************************#
+# This module is part of the repository CNDB.
+#
+# This module is licensed under the terms of the BSD 3-Clause License
+# <http://www.c-tanzer.at/license/bsd_3c.html>.
+# #*** </License> ***********************************************************#
+
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import unittest
+
+try :
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError :
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from ff_spider             import spiderpool
+from ff_spider.cache       import Latency_History, Negative_Cache
+from ff_spider.cache       import Topology_Cache
+from ff_spider.journal     import Journal
+from ff_spider.parser      import Guess
+from ff_spider.schedule    import Revisit_Queue
+
+pages = os.path.join (os.path.dirname (__file__), 'pages')
+
+class Page_Handler (BaseHTTPRequestHandler) :
+    """ Answer every request with the OLSR sample page """
+
+    def do_GET (self) :
+        f = open (os.path.join (pages, 'olsr', 'index.html'), 'rb')
+        body = f.read ()
+        f.close ()
+        self.send_response (200)
+        self.send_header ('Content-Type',   'text/html')
+        self.send_header ('Content-Length', str (len (body)))
+        self.end_headers ()
+        self.wfile.write (body)
+    # end def do_GET
+
+    def log_message (self, * args) :
+        pass
+    # end def log_message
+
+# end class Page_Handler
+
+class Slow_Handler (BaseHTTPRequestHandler) :
+    """ Keep every request waiting until `release` is set """
+
+    release = threading.Event ()
+
+    def do_GET (self) :
+        self.release.wait (60)
+        self.send_response (503)
+        self.end_headers ()
+    # end def do_GET
+
+    def log_message (self, * args) :
+        pass
+    # end def log_message
+
+# end class Slow_Handler
+
+class Topology (object) :
+    """ OLSR container with the given nodes (without links), `mid` maps
+        main addresses to their aliases.
+    """
+
+    def __init__ (self, nodes, mid = {}) :
+        self.topo    = self
+        self.mid     = self
+        self.forward = dict ((ip, set ()) for ip in nodes)
+        self.reverse = {}
+        self.by_ip   = mid
+    # end def __init__
+
+# end class Topology
+
+class Test_Latency (unittest.TestCase) :
+
+    def setUp (self) :
+        self.server = HTTPServer (('127.0.0.1', 0), Page_Handler)
+        self.thread = threading.Thread (target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start ()
+    # end def setUp
+
+    def tearDown (self) :
+        self.server.shutdown ()
+        self.server.server_close ()
+    # end def tearDown
+
+    def test_node_with_history (self) :
+        ip = '127.0.0.1'
+        lh = Latency_History (None)
+        lh.update (ip, 12.37, 0.42)
+        timeout = lh.timeout (ip, 180)
+        self.assertTrue (isinstance (timeout, int))
+        self.assertEqual (timeout, 35)
+        handler = signal.getsignal (signal.SIGALRM)
+        port    = self.server.server_address [1]
+        r_ip, result, info = spiderpool.get_node_info \
+            (ip, timeout = timeout, ip_port = {ip : port})
+        self.assertEqual (r_ip, ip)
+        self.assertTrue (isinstance (result, Guess), result)
+        self.assertEqual (result.version, '0.6.6.2')
+        self.assertEqual (signal.getsignal (signal.SIGALRM), handler)
+        self.assertEqual (signal.alarm (0), 0)
+        lh.update (ip, info ['duration'], info ['ttfb'])
+        self.assertTrue (isinstance (lh.timeout (ip, 180), int))
+    # end def test_node_with_history
+
+# end class Test_Latency
+
+class Test_Aliases (unittest.TestCase) :
+    """ Aliases of nodes with a result from an earlier run """
+
+    main  = '10.0.0.1'
+    alias = '10.0.0.2'
+
+    def setUp (self) :
+        self.get_olsr_container = spiderpool.get_olsr_container
+        spiderpool.get_olsr_container = lambda filename : Topology \
+            ([self.main, self.alias], {self.main : set ((self.alias,))})
+    # end def setUp
+
+    def tearDown (self) :
+        spiderpool.get_olsr_container = self.get_olsr_container
+    # end def tearDown
+
+    def test_incremental (self) :
+        server = HTTPServer (('127.0.0.1', 0), Page_Handler)
+        thread = threading.Thread (target = server.serve_forever)
+        thread.daemon = True
+        thread.start ()
+        ip     = '127.0.0.1'
+        port   = server.server_address [1]
+        guess  = spiderpool.get_node_info (ip, ip_port = {ip : port}) [1]
+        server.shutdown ()
+        server.server_close ()
+        self.assertTrue (isinstance (guess, Guess), guess)
+        incremental = Topology_Cache (None)
+        incremental.update (self.main, ())
+        sp = spiderpool.Spider \
+            ( 'olsr'
+            , incremental = incremental
+            , previous    = {self.main : guess}
+            )
+        self.assertTrue (sp.result_dict [self.alias] is guess)
+        self.assertEqual (list (sp.tasks ()), [])
+    # end def test_incremental
+
+    def test_negative_cache (self) :
+        negative = Negative_Cache (None)
+        negative.update (self.main, ('Timeout_Error', 'Timeout'))
+        sp = spiderpool.Spider ('olsr', negative = negative)
+        self.assertTrue (self.alias not in sp.result_dict)
+        self.assertEqual \
+            ([ip for ip, task in sp.tasks ()], [self.alias])
+    # end def test_negative_cache
+
+# end class Test_Aliases
+
+class Test_Daemon (unittest.TestCase) :
+
+    engines = \
+        ( (spiderpool.Daemon_Spider,        {})
+        , (spiderpool.Daemon_Thread_Spider, dict (threads = 2))
+        , (spiderpool.Daemon_Hybrid_Spider, dict (threads = 2))
+        )
+
+    def setUp (self) :
+        Slow_Handler.release.clear ()
+        self.server = HTTPServer (('127.0.0.1', 0), Slow_Handler)
+        self.thread = threading.Thread (target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start ()
+        self.tmpdir = tempfile.mkdtemp ()
+        self.get_olsr_container = spiderpool.get_olsr_container
+        spiderpool.get_olsr_container = \
+            lambda filename : Topology (['127.0.0.1'])
+        self.sigint  = signal.signal \
+            (signal.SIGINT, signal.default_int_handler)
+        self.sigalrm = signal.signal (signal.SIGALRM, self.hang)
+    # end def setUp
+
+    def tearDown (self) :
+        signal.alarm (0)
+        signal.signal (signal.SIGALRM, self.sigalrm)
+        signal.signal (signal.SIGINT,  self.sigint)
+        spiderpool.get_olsr_container = self.get_olsr_container
+        Slow_Handler.release.set ()
+        self.server.shutdown ()
+        self.server.server_close ()
+        shutil.rmtree (self.tmpdir)
+    # end def tearDown
+
+    def hang (self, * args) :
+        raise AssertionError ("Daemon hangs after Ctrl-C")
+    # end def hang
+
+    def interrupt (self) :
+        """ Like Ctrl-C on a terminal: SIGINT to workers and to us """
+        for p in multiprocessing.active_children () :
+            os.kill (p.pid, signal.SIGINT)
+        os.kill (os.getpid (), signal.SIGINT)
+    # end def interrupt
+
+    def test_interrupt (self) :
+        port = self.server.server_address [1]
+        dump = os.path.join (self.tmpdir, 'spider.dump')
+        for engine, kw in self.engines :
+            sp = engine \
+                ( 'olsr'
+                , processes = 2
+                , ip_port   = {'127.0.0.1' : port}
+                , journal   = Journal (dump + '.journal')
+                , revisit   = Revisit_Queue (dump + '.revisit')
+                , dump      = dump
+                , ** kw
+                )
+            timer = threading.Timer (1, self.interrupt)
+            timer.start ()
+            signal.alarm (30)
+            sp.process ()
+            signal.alarm (0)
+            timer.join ()
+            self.assertTrue (os.path.exists (dump), engine.__name__)
+            self.assertEqual \
+                (multiprocessing.active_children (), [], engine.__name__)
+    # end def test_interrupt
+
+# end class Test_Daemon
+
+if __name__ == '__main__' :
+    unittest.main ()